@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from combine_json import (convert_ecolist_df, split_sites, parse_ecojson, scan_ecojson, batched, open_sqlite,
+                          create_tables, write_sqlite, create_indexes)
+from mock_edit import SyntheticEDIT, write_ecojson_tree
+
+
+def synthetic_ecolist(n, seed = 0):
+    source = SyntheticEDIT(geoUnits = (n + 499) // 500, ecoclasses = 500, seed = seed)
+    ids = [e for g in source.geoUnits for e in source.ecoclass_ids(g)][:n]
+    return [parse_ecojson(e, source.ecoclass(e)) for e in ids]
+
+
+def scan(path, processes):
+    # read_ecojson reports every file it reads
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        return list(scan_ecojson(path, processes = processes))
+
+
+def load_sqlite(db_path, ecolist, batch_size):
+    if os.path.isfile(db_path):
+        os.remove(db_path)
+    con = open_sqlite(db_path)
+    create_tables(con)
+    for batch in batched(ecolist, batch_size):
+        write_sqlite(con, convert_ecolist_df(batch))
+    create_indexes(con)
+    con.close()
+
+
+def timed(label, f, repeat, *args, **kwargs):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        out = f(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    print(f'{label:<22}best {min(times):8.3f}s  mean {sum(times) / len(times):8.3f}s')
+    return out
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Benchmark scanning, ecosite name parsing, site splitting and the'
+                                                 ' SQLite load on synthetic ecosites.')
+    parser.add_argument('-n', '--ecosites', type = int, nargs = '*', default = [10000, 100000],
+                        help = 'number of synthetic ecosites per run (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+                        help = 'timed repetitions per step (default: %(default)s)')
+    parser.add_argument('-j', '--processes', type = int,
+                        help = 'scan_ecojson processes (default: one per CPU)')
+    parser.add_argument('-b', '--batch_size', type = int, default = 5000,
+                        help = 'ecosites per SQLite batch (default: %(default)s)')
+    parser.add_argument('--no_scan', action = 'store_true',
+                        help = 'do not write synthetic ecosite files and time scan_ecojson over them')
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'bench_combine_')
+    try:
+        for n in args.ecosites:
+            print(f'\n{n} ecosites')
+            if args.no_scan:
+                ecolist = synthetic_ecolist(n)
+            else:
+                scan_path = os.path.join(tmp_dir, str(n))
+                write_ecojson_tree(scan_path, n)
+                ecolist = timed('scan_ecojson', scan, args.repeat, scan_path, args.processes)
+            eco_df = timed('convert_ecolist_df', convert_ecolist_df, args.repeat, ecolist)
+            timed('split_sites', split_sites, args.repeat, eco_df)
+            timed('sqlite load', load_sqlite, args.repeat, os.path.join(tmp_dir, 'bench.sqlite'), ecolist,
+                  args.batch_size)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from download_EDIT import download_edit, set_base_url, HOST_LIMIT, REPORT_NAME
+from mock_edit import SyntheticEDIT, start_mock
+
+
+def run_download(source, concurrency, host_limit, store, prune):
+    path = tempfile.mkdtemp(prefix = 'bench_edit_')
+    try:
+        start = time.perf_counter()
+        download_edit(path = path, geoUnits = source.geoUnits, eco_all = True, state_save = True,
+                      concurrency = concurrency, host_limit = host_limit, store = store, prune = prune,
+                      cache_ttl = 0)
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(path, REPORT_NAME)) as f:
+            totals = json.load(f).get('totals')
+    finally:
+        shutil.rmtree(path)
+    return (elapsed, totals)
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Benchmark download_edit against a local mock of EDIT serving'
+                                                 ' synthetic responses.')
+    parser.add_argument('-n', '--ecoclasses', type = int, nargs = '*', default = [10, 50],
+                        help = 'synthetic ecoclasses per geoUnit, one run per value (default: %(default)s)')
+    parser.add_argument('-g', '--geoUnits', type = int, default = 2,
+                        help = 'number of synthetic geoUnits (default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type = int, nargs = '*', default = [1, 4, 8],
+                        help = 'download_edit concurrency, one run per value (default: %(default)s)')
+    parser.add_argument('--host_limit', type = int, default = HOST_LIMIT,
+                        help = 'simultaneous requests to the mock (default: %(default)s)')
+    parser.add_argument('--latency', type = float, default = 0.05,
+                        help = 'seconds the mock adds to every response (default: %(default)s)')
+    parser.add_argument('--error_rate', type = float, default = 0.0,
+                        help = 'share of requests the mock answers with a 503 (default: %(default)s)')
+    parser.add_argument('--pdf_size', type = int, default = 200000,
+                        help = 'bytes in each synthetic PDF (default: %(default)s)')
+    parser.add_argument('--store', choices = ['files', 'pack'], default = 'files',
+                        help = 'download_edit storage backend (default: %(default)s)')
+    parser.add_argument('-P', '--prune', action = 'store_true', help = 'plan requests with download_edit pruning')
+    parser.add_argument('-r', '--repeat', type = int, default = 1,
+                        help = 'timed repetitions per run (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    # retries against the injected errors are expected; only the timings are of interest
+    logging.getLogger('download_EDIT').setLevel(logging.ERROR)
+
+    for n in args.ecoclasses:
+        source = SyntheticEDIT(geoUnits = args.geoUnits, ecoclasses = n, pdf_size = args.pdf_size)
+        server = start_mock(source, latency = args.latency, error_rate = args.error_rate)
+        set_base_url(server.url)
+        print(f'\n{len(source.geoUnits) * source.n_ecoclasses} ecoclasses, latency {args.latency}s, '
+              f'error rate {args.error_rate}')
+        try:
+            for c in args.concurrency:
+                runs = [run_download(source, c, args.host_limit, args.store, args.prune) for i in range(args.repeat)]
+                times = [x[0] for x in runs]
+                elapsed, totals = min(runs, key = lambda x: x[0])
+                print(f'concurrency {c:<10}best {min(times):8.3f}s  mean {sum(times) / len(times):8.3f}s  '
+                      f'{totals["requests"]:6d} req  {totals["retries"]:4d} retries  '
+                      f'{totals["files"] / elapsed:8.1f} files/s  {totals["bytes"] / elapsed / 1e6:6.1f} MB/s')
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+NAMES_1 = ['Loamy', 'Shallow Loamy', 'Clayey', 'Sandy', 'Stony Hills', 'North Slopes', 'Wet Meadow']
+NAMES_2 = ['10-14" P.Z.', '12+ PZ', '8 to 10" P.Z.', '16" PZ', 'ARTRW8/PSSPS', 'ARTRW8-PUTR2/FEID-PSSPS',
+           'PIPO/FEID', 'Loamy 10-14" P.Z.', '', None]
+DOMINANTS = ['Artemisia tridentata', 'Pseudoroegneria spicata', 'Pinus ponderosa', 'Festuca idahoensis', None]
+SECTIONS = ['overview', 'climatic-features', 'ecological-dynamics', 'general-information', 'interpretations',
+            'physiographic-features', 'reference-sheet', 'soil-features', 'supporting-information',
+            'water-features']
+PLANT_TYPES = ['grass/grasslike', 'forb', 'shrub/subshrub', 'tree']
+
+# community tables EDIT does not have for a site type (R rangeland, F forest) are answered with a 404, as
+# snag counts almost always are
+MISSING_TABLES = {'R': ['forest-overstory', 'forest-understory', 'snag-count'],
+                  'F': ['rangeland-plant-composition', 'snag-count']}
+
+CONTENT_TYPES = {'.json': 'application/json', '.txt': 'text/tab-separated-values', '.pdf': 'application/pdf'}
+
+
+def geoUnit_symbol(i):
+    return ''.join((str(10 + i).zfill(3), 'X'))
+
+
+def ecoclass_id(geoUnit, i):
+    return ''.join(('RF'[i % 2], geoUnit, 'Y', str(i).zfill(3), 'OR'))
+
+
+def not_found(path):
+    return (404, json.dumps({'error': ' '.join(('Not found:', path))}).encode(), 'application/json')
+
+
+class SyntheticEDIT:
+    # generated catalog of `geoUnits` geoUnits with `ecoclasses` ecoclasses each (at most 999) and
+    # `communities` plant communities per ecoclass; every response is derived from its ecoclass id, so the same
+    # request always gets the same body
+    def __init__(self, geoUnits = 2, ecoclasses = 10, communities = 2, pdf_size = 200000, seed = 0):
+        self.geoUnits = [geoUnit_symbol(i) for i in range(geoUnits)]
+        self.n_ecoclasses = min(ecoclasses, 999)
+        self.communities = communities
+        self.pdf_size = pdf_size
+        self.seed = seed
+
+    def ecoclass_ids(self, geoUnit):
+        return [ecoclass_id(geoUnit, i) for i in range(1, self.n_ecoclasses + 1)]
+
+    def is_ecoclass(self, geoUnit, ecoclass):
+        return (geoUnit in self.geoUnits and len(ecoclass) == 11 and ecoclass[1:5] == geoUnit
+                and ecoclass[6:9].isdigit() and 0 < int(ecoclass[6:9]) <= self.n_ecoclasses)
+
+    def rng(self, *keys):
+        return random.Random('/'.join([str(self.seed)] + [str(k) for k in keys]))
+
+    def geo_unit_list(self):
+        return {'geoUnits': [{'symbol': g, 'name': ' '.join(('Synthetic MLRA', g))} for g in self.geoUnits]}
+
+    def class_list(self, geoUnit):
+        return {'ecoclasses': [{'id': e, 'name': self.rng(e).choice(NAMES_1)} for e in self.ecoclass_ids(geoUnit)]}
+
+    def ecoclass(self, ecoclass):
+        rng = self.rng(ecoclass)
+        geoUnit = ecoclass[1:5]
+        n_sites = rng.randint(0, 6)
+        sites = [{'symbol': ecoclass_id(geoUnit, rng.randint(1, self.n_ecoclasses))} for x in range(n_sites)]
+        dominants = {}
+        for gh in ['Tree', 'Shrub', 'Herb']:
+            for rank in [1, 2]:
+                dominants[''.join(('dominant', gh, str(rank)))] = rng.choice(DOMINANTS)
+        return {'generalInformation': {'narratives': {'ecoclassName': rng.choice(NAMES_1),
+                                                      'ecoclassSecondaryName': rng.choice(NAMES_2),
+                                                      'ecoclassTertiaryName': None},
+                                       'associatedSites': sites,
+                                       'similarSites': sites[:2],
+                                       'dominantSpecies': dominants}}
+
+    def states(self, ecoclass):
+        states = [{'landUse': 1, 'state': 1, 'community': c} for c in range(1, self.communities + 1)]
+        # a state without plant communities, which the crawler skips
+        states.append({'landUse': 1, 'state': 2, 'community': 'NA'})
+        return {'states': states}
+
+    def section(self, ecoclass, name):
+        rng = self.rng(ecoclass, name)
+        return {'ecoclass': ecoclass, 'section': name,
+                'narratives': [' '.join(rng.choices(NAMES_1, k = 40)) for x in range(rng.randint(1, 8))]}
+
+    def table(self, ecoclass, name, community):
+        rng = self.rng(ecoclass, name, community)
+        rows = []
+        for plant_type in PLANT_TYPES:
+            low = rng.randint(0, 500)
+            high = low + rng.randint(0, 1000)
+            rows.append({'plantType': plant_type, 'productionLow': low, 'productionHigh': high,
+                         'production': {'rv': (low + high) // 2}})
+        return {'rows': rows}
+
+    def text_table(self, name, keys):
+        lines = ['\t'.join(('id', 'name', 'value'))]
+        lines.extend(['\t'.join((k, name, str(i))) for i, k in enumerate(keys)])
+        return '\n'.join(lines) + '\n'
+
+    def pdf(self, key):
+        return b''.join((b'%PDF-1.4\n', key.encode(), b'\n', b'0' * self.pdf_size))
+
+    def route(self, path):
+        # returns (status, body bytes, content type) for a request path
+        parts = path.strip('/').split('/')
+        if len(parts) < 4 or parts[0] != 'services' or parts[2] != 'esd':
+            return not_found(path)
+        kind = parts[1]
+        rest = parts[3:]
+        fname, ext = os.path.splitext(rest[-1])
+        ctype = CONTENT_TYPES.get(ext)
+        if ctype is None:
+            return not_found(path)
+        body = None
+        if kind == 'downloads' and len(rest) == 1:
+            if fname == 'geo-unit-list':
+                body = self.geo_unit_list() if ext == '.json' else self.text_table(fname, self.geoUnits)
+            elif fname == 'class-list' and ext == '.txt':
+                body = self.text_table(fname, [e for g in self.geoUnits for e in self.ecoclass_ids(g)])
+        elif kind == 'downloads' and len(rest) == 2 and rest[0] in self.geoUnits:
+            if fname == 'class-list' and ext == '.json':
+                body = self.class_list(rest[0])
+            elif ext == '.txt':
+                body = self.text_table(fname, self.ecoclass_ids(rest[0]))
+        elif kind == 'descriptions' and len(rest) == 1 and ext == '.pdf' and fname in self.geoUnits:
+            body = self.pdf(fname)
+        elif kind == 'descriptions' and len(rest) == 2 and self.is_ecoclass(rest[0], fname):
+            body = self.ecoclass(fname) if ext == '.json' else self.pdf(fname)
+        elif kind == 'descriptions' and len(rest) == 3 and self.is_ecoclass(rest[0], rest[1]):
+            if fname in SECTIONS and ext == '.json':
+                body = self.section(rest[1], fname)
+        elif kind == 'models' and len(rest) == 3 and self.is_ecoclass(rest[0], rest[1]):
+            if fname == 'states':
+                body = self.states(rest[1])
+            elif fname == 'transitions':
+                body = self.section(rest[1], fname)
+        elif kind == 'plant-community-tables' and len(rest) == 6 and self.is_ecoclass(rest[0], rest[1]):
+            communities = [str(c) for c in range(1, self.communities + 1)]
+            if fname not in MISSING_TABLES.get(rest[1][0], []) and rest[2:4] == ['1', '1'] and \
+               rest[4] in communities:
+                body = self.table(rest[1], fname, rest[4])
+        if body is None:
+            return not_found(path)
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        return (200, body, ctype)
+
+
+def recorded_path(path):
+    # where a FileStore download tree (see download_EDIT.py) keeps the response to a request path
+    parts = path.strip('/').split('/')
+    if len(parts) < 4 or parts[0] != 'services':
+        return None
+    kind = parts[1]
+    rest = parts[2:]
+    if kind == 'plant-community-tables' and len(rest) == 7:
+        return os.path.join(*rest[:3], '_'.join(rest[3:6]), rest[6])
+    if kind == 'descriptions' and len(rest) in (2, 3):
+        fname = rest[-1]
+        return os.path.join(*rest[:-1], os.path.splitext(fname)[0], fname)
+    return os.path.join(*rest)
+
+
+class RecordedEDIT:
+    # replays a download tree saved by download_EDIT.py; catalog and class list JSON are only saved with
+    # --world and --geounit_world, so record with both to replay a full crawl
+    def __init__(self, root):
+        self.root = root
+
+    def route(self, path):
+        rel_path = recorded_path(path)
+        if rel_path is None:
+            return not_found(path)
+        full_path = os.path.join(self.root, rel_path)
+        if not os.path.isfile(full_path):
+            return not_found(path)
+        with open(full_path, 'rb') as f:
+            body = f.read()
+        return (200, body, CONTENT_TYPES.get(os.path.splitext(full_path)[1], 'application/octet-stream'))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # small responses would otherwise wait on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, ctype, headers = None):
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        server.count('requests')
+        if server.latency:
+            time.sleep(random.uniform(server.latency * (1 - server.jitter), server.latency * (1 + server.jitter)))
+        if server.error_rate and random.random() < server.error_rate:
+            server.count('errors')
+            return self.send(503, b'Service Unavailable', 'text/plain', {'Retry-After': '0'})
+        status, body, ctype = server.source.route(path)
+        if status != 200:
+            server.count('not_found')
+            return self.send(status, body, ctype)
+        etag = ''.join(('"', hashlib.sha1(body).hexdigest()[:16], '"'))
+        if self.headers.get('If-None-Match') == etag:
+            server.count('not_modified')
+            return self.send(304, b'', ctype, {'ETag': etag})
+        server.count('bytes', len(body))
+        self.send(200, body, ctype, {'ETag': etag})
+
+
+class MockServer(ThreadingHTTPServer):
+    # `latency` seconds (+/- `jitter` of it) are added to every response and `error_rate` of requests get a
+    # 503 with Retry-After: 0
+    daemon_threads = True
+
+    def __init__(self, source, port = 0, latency = 0.0, jitter = 0.5, error_rate = 0.0):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.source = source
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'not_found': 0, 'not_modified': 0, 'bytes': 0}
+
+    @property
+    def url(self):
+        return ''.join(('http://127.0.0.1:', str(self.server_address[1])))
+
+    def handle_error(self, request, client_address):
+        # clients dropping pooled keep-alive connections are not errors worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count(self, key, n = 1):
+        with self.lock:
+            self.stats[key] += n
+
+
+def start_mock(source, port = 0, latency = 0.0, jitter = 0.5, error_rate = 0.0):
+    # serves `source` from a background thread; stop with server.shutdown() and server.server_close()
+    server = MockServer(source, port = port, latency = latency, jitter = jitter, error_rate = error_rate)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server
+
+
+def write_ecojson_tree(path, n, seed = 0):
+    # the ecosite JSON files of `n` synthetic ecoclasses in the download layout, for combine_json.py
+    per_geoUnit = 500
+    source = SyntheticEDIT(geoUnits = (n + per_geoUnit - 1) // per_geoUnit, ecoclasses = per_geoUnit, seed = seed)
+    ids = [e for g in source.geoUnits for e in source.ecoclass_ids(g)][:n]
+    for ecoclass in ids:
+        out_dir = os.path.join(path, 'esd', ecoclass[1:5], ecoclass)
+        os.makedirs(out_dir, exist_ok = True)
+        with open(os.path.join(out_dir, '.'.join((ecoclass, 'json'))), 'w', encoding = 'utf-8') as f:
+            json.dump(source.ecoclass(ecoclass), f)
+    return ids
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Serve synthetic or recorded EDIT responses locally, for running'
+                                                 ' download_EDIT.py --base_url against.')
+    parser.add_argument('--port', type = int, default = 8765, help = 'port to listen on (default: %(default)s)')
+    parser.add_argument('-g', '--geoUnits', type = int, default = 2,
+                        help = 'number of synthetic geoUnits (default: %(default)s)')
+    parser.add_argument('-n', '--ecoclasses', type = int, default = 10,
+                        help = 'synthetic ecoclasses per geoUnit, at most 999 (default: %(default)s)')
+    parser.add_argument('--communities', type = int, default = 2,
+                        help = 'plant communities per synthetic ecoclass (default: %(default)s)')
+    parser.add_argument('--pdf_size', type = int, default = 200000,
+                        help = 'bytes in each synthetic PDF (default: %(default)s)')
+    parser.add_argument('--replay',
+                        help = 'download tree saved by download_EDIT.py to serve instead of synthetic data')
+    parser.add_argument('--latency', type = float, default = 0.0,
+                        help = 'seconds added to every response (default: %(default)s)')
+    parser.add_argument('--jitter', type = float, default = 0.5,
+                        help = 'latency varies by up to this share either way (default: %(default)s)')
+    parser.add_argument('--error_rate', type = float, default = 0.0,
+                        help = 'share of requests answered with a 503 (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        source = RecordedEDIT(args.replay)
+    else:
+        source = SyntheticEDIT(geoUnits = args.geoUnits, ecoclasses = args.ecoclasses,
+                               communities = args.communities, pdf_size = args.pdf_size)
+    server = MockServer(source, port = args.port, latency = args.latency, jitter = args.jitter,
+                        error_rate = args.error_rate)
+    print('Serving mock EDIT at', server.url)
+    if not args.replay:
+        print('geoUnits:', ' '.join(source.geoUnits))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('\n', server.stats, sep = '')
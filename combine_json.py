@@ -2,48 +2,174 @@
 import os
 import re
 import json
+import hashlib
 import sys
 import argparse
+import multiprocessing
+from itertools import islice
 import pandas as pd
-import numpy as np
 import sqlite3 as sqlite
+from edit_store import find_packs, list_pack, iter_pack
 
+# orjson parses the ecosite files several times faster when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-def scan_ecojson(path):
-    p = re.compile(r'[A-Z]\d{3}[A-Z]{2}\d{3}[A-Z]{2}')
-    ecolist = []
+ECO_PAT = re.compile(r'[A-Z]\d{3}[A-Z]{2}\d{3}[A-Z]{2}')
+
+# string columns with few distinct values, dictionary encoded in Parquet output
+PARQUET_DICT_COLUMNS = ['ecosite_name_1', 'ecosite_name_2', 'ecosite_name_3', 'dominantTree1', 'dominantTree2',
+                        'dominantShrub1', 'dominantShrub2', 'dominantHerb1', 'dominantHerb2', 'plants',
+                        'asc_site', 'sim_site']
+
+# precipitation zone (e.g. '10-14" P.Z.') and plant code (e.g. 'ARTRW8/PSSPS') patterns in ecosite_name_2
+PZ_PAT = r'^(\d+)\s*[\-\+to]*\s*(\d+)?"?\s*P?\.?Z?\.?$'
+PLANT_PAT = r'([A-Za-z]{4,}\d*/?\-?)'
+
+# general_info columns, fixed so every batch written to a CSV or table lines up
+ECO_COLUMNS = ['ecosite_id', 'mlra', 'ecosite_name_1', 'ecosite_name_2', 'ecosite_name_3', 'asc_sites',
+               'sim_sites', 'dominantTree1', 'dominantTree2', 'dominantShrub1', 'dominantShrub2',
+               'dominantHerb1', 'dominantHerb2']
+
+
+def find_ecojson(path, ledger = None):
+    # files whose size and modification time match the ingest ledger are unchanged and are not yielded
+    if ledger is None:
+        ledger = {}
     for root, dirs, files in os.walk(path):
         for f in files:
             fsplit = os.path.splitext(f)
             fbase = fsplit[0]
             fext = fsplit[1]
-            match = p.match(fbase)
+            match = ECO_PAT.match(fbase)
             if match and fext == '.json':
-                ecodict = {'ecosite_id': fbase}
-                ecodict['mlra'] = fbase[1:5]
                 full_path = os.path.join(root, f)
-                rel_path = full_path.replace(path, '').lstrip(os.path.sep)
-                print("Reading", rel_path)
-                with open(full_path, 'r' , encoding = 'utf-8') as jf:
-                    d = json.load(jf)
-                geninfo = d.get('generalInformation')
-                if geninfo:
-                    nar = geninfo.get('narratives')
-                    if nar:
-                        ecodict['ecosite_name_1'] = nar.get('ecoclassName')
-                        ecodict['ecosite_name_2'] = nar.get('ecoclassSecondaryName')
-                        ecodict['ecosite_name_3'] = nar.get('ecoclassTertiaryName')
-                    asc_sites = geninfo.get('associatedSites')
-                    asc_list = [x.get('symbol') for x in asc_sites]
-                    ecodict['asc_sites'] = ';'.join(asc_list)
-                    sim_sites = geninfo.get('similarSites')
-                    sim_list = [x.get('symbol') for x in sim_sites]
-                    ecodict['sim_sites'] = ';'.join(sim_list)
-                    dom_species = geninfo.get('dominantSpecies')
-                    if dom_species:
-                        ecodict = ecodict | dom_species
-                ecolist.append(ecodict)
-    return ecolist
+                known = ledger.get(os.path.abspath(full_path))
+                if known:
+                    st = os.stat(full_path)
+                    if known[0] == st.st_mtime and known[1] == st.st_size:
+                        continue
+                yield full_path
+
+
+def parse_ecojson(ecosite_id, d):
+    ecodict = {'ecosite_id': ecosite_id}
+    ecodict['mlra'] = ecosite_id[1:5]
+    geninfo = d.get('generalInformation')
+    if geninfo:
+        nar = geninfo.get('narratives')
+        if nar:
+            ecodict['ecosite_name_1'] = nar.get('ecoclassName')
+            ecodict['ecosite_name_2'] = nar.get('ecoclassSecondaryName')
+            ecodict['ecosite_name_3'] = nar.get('ecoclassTertiaryName')
+        asc_sites = geninfo.get('associatedSites')
+        asc_list = [x.get('symbol') for x in asc_sites]
+        ecodict['asc_sites'] = ';'.join(asc_list)
+        sim_sites = geninfo.get('similarSites')
+        sim_list = [x.get('symbol') for x in sim_sites]
+        ecodict['sim_sites'] = ';'.join(sim_list)
+        dom_species = geninfo.get('dominantSpecies')
+        if dom_species:
+            ecodict = ecodict | dom_species
+    return ecodict
+
+
+def read_ecojson(full_path, path = ''):
+    fbase = os.path.splitext(os.path.basename(full_path))[0]
+    rel_path = full_path.replace(path, '').lstrip(os.path.sep)
+    print("Reading", rel_path)
+    st = os.stat(full_path)
+    with open(full_path, 'rb') as jf:
+        content = jf.read()
+    ecodict = parse_ecojson(fbase, json_loads(content))
+    # file facts for the ingest ledger; not a general_info column
+    ecodict['source'] = {'path': os.path.abspath(full_path), 'mtime': st.st_mtime, 'size': st.st_size,
+                         'sha256': hashlib.sha256(content).hexdigest(), 'ecosite_id': fbase}
+    return ecodict
+
+
+def find_ecopacks(path, ledger = None):
+    # yields (pack, entries) for ecosite files stored in download packs (see edit_store.py); entries are
+    # (name, size, stored) and, as with loose files, those matching the ingest ledger are left out
+    if ledger is None:
+        ledger = {}
+    for pack in find_packs(path):
+        entries = []
+        for name, size, stored in list_pack(pack):
+            fsplit = os.path.splitext(name.split('/')[-1])
+            if ECO_PAT.match(fsplit[0]) and fsplit[1] == '.json':
+                known = ledger.get('#'.join((os.path.abspath(pack), name)))
+                if known and known[0] == stored and known[1] == size:
+                    continue
+                entries.append((name, size, stored))
+        if entries:
+            yield (pack, entries)
+
+
+def read_ecopack(pack, entries):
+    facts = {x[0]: x[1:] for x in entries}
+    print("Reading", len(entries), "ecosites from", pack)
+    for name, content in iter_pack(pack, names = facts.keys()):
+        fbase = os.path.splitext(name.split('/')[-1])[0]
+        ecodict = parse_ecojson(fbase, json_loads(content))
+        size, stored = facts.get(name)
+        ecodict['source'] = {'path': '#'.join((os.path.abspath(pack), name)), 'mtime': stored, 'size': size,
+                             'sha256': hashlib.sha256(content).hexdigest(), 'ecosite_id': fbase}
+        yield ecodict
+
+
+def scan_ecojson(path, processes = None, chunksize = 64, ledger = None):
+    # yields one dict per ecosite file as it is parsed, loose files first and then those in download packs;
+    # with more than one process, files (and packs, `chunksize` entries at a time) are parsed in a worker pool
+    # and yielded in walk order
+    paths = find_ecojson(path, ledger = ledger)
+    packs = find_ecopacks(path, ledger = ledger)
+    if processes == 1:
+        for full_path in paths:
+            yield read_ecojson(full_path, path)
+        for pack, entries in packs:
+            yield from read_ecopack(pack, entries)
+        return
+    # the pool is fed a window at a time, so no more than two windows of parsed files wait on a slow consumer
+    window = chunksize * (processes or os.cpu_count() or 1) * 2
+    with multiprocessing.Pool(processes = processes) as pool:
+        args = ((full_path, path) for full_path in paths)
+        yield from imap_windowed(pool, read_ecojson_args, args, window, chunksize)
+        args = ((pack, entries[i:i + chunksize]) for pack, entries in packs for i in range(0, len(entries), chunksize))
+        for ecolist in imap_windowed(pool, read_ecopack_args, args, window // chunksize, 1):
+            yield from ecolist
+
+
+def imap_windowed(pool, func, iterable, window, chunksize):
+    # the next window is queued before the current one is yielded, keeping the workers busy meanwhile
+    pending = None
+    for batch in batched(iterable, window):
+        results = pool.imap(func, batch, chunksize = chunksize)
+        if pending is not None:
+            yield from pending
+        pending = results
+    if pending is not None:
+        yield from pending
+
+
+def read_ecojson_args(args):
+    return read_ecojson(*args)
+
+
+def read_ecopack_args(args):
+    return list(read_ecopack(*args))
+
+
+def batched(iterable, n):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, n))
+        if not batch:
+            return
+        yield batch
 
 
 def convert_ecolist_df(ecolist, sp_df = None):
@@ -61,44 +187,218 @@ def convert_ecolist_df(ecolist, sp_df = None):
     #                               stubnames='dominant', suffix = r'[A-Za-z]{4,5}',
     #                               i = ['ecosite_id', 'rank'], j = 'gh').reset_index()
 
-    edf = pd.DataFrame.from_dict(ecolist)
-    names2 = edf['ecosite_name_2'].to_list()
-    pz_search = [re.search(r'^(\d+)\s*[\-\+to]*\s*(\d+)?"?\s*P?\.?Z?\.?$', x) for x in names2]
-    pz_groups = [x.groups() if x is not None else (None, None) for x in pz_search]
-    pz_df = pd.DataFrame.from_records(pz_groups, columns =['pz_l', 'pz_h']).astype(float)\
-            .fillna(value=np.nan)
-    pz_float = pz_df.apply(pd.to_numeric)
-    ndf = edf.join(pz_float)
-
-    plants_search =  [''.join(re.findall(r'([A-Za-z]{4,}\d*/?\-?)', x)) for x in names2]
-    plant_repl = [x if x != '' else None for x in plants_search]
-    plant_df = pd.DataFrame(plant_repl, columns =['plants'])
+    edf = pd.DataFrame.from_dict(ecolist).reindex(columns = ECO_COLUMNS)
+    names2 = edf['ecosite_name_2'].astype('string')
+    pz_df = names2.str.extract(PZ_PAT).astype(float)
+    pz_df.columns = ['pz_l', 'pz_h']
+    ndf = edf.join(pz_df)
+
+    plants = names2.str.findall(PLANT_PAT).str.join('').astype(object)
+    plant_df = plants.where(plants.notna() & (plants != ''), None).to_frame(name = 'plants')
     nndf = ndf.join(plant_df).replace(r'^\s*$', None, regex=True)
 
     return nndf
-         
+
+
+def explode_sites(df, col, name):
+    sites = df.loc[df[col].notna() & (df[col] != ''), ['mlra', 'ecosite_id', col]]
+    sites = sites.assign(**{name: sites[col].str.split(';')}).explode(name)
+    return sites[['mlra', 'ecosite_id', name]].drop_duplicates().reset_index(drop=True)
+
+
 def split_sites(df):
-    site_dict = df[['ecosite_id', 'mlra', 'asc_sites', 'sim_sites']].to_dict('records')
-    asc_dlist = []
-    sim_dlist = []
-    for d in site_dict:
-        ecosite_id = d.get('ecosite_id')
-        mlra = d.get('mlra')
-        asc_sites = d.get('asc_sites')
-        if asc_sites:
-            asc_list = asc_sites.split(';')
-            for a in asc_list:
-                asc_dlist.append({'mlra': mlra, 'ecosite_id': ecosite_id, 'asc_site': a})
-        sim_sites = d.get('sim_sites')
-        if sim_sites:
-            sim_list = sim_sites.split(';')
-            for s in sim_list:
-                sim_dlist.append({'mlra': mlra, 'ecosite_id': ecosite_id, 'sim_site': s})
-    asc_df = pd.DataFrame(asc_dlist)
-    sim_df = pd.DataFrame(sim_dlist)
+    asc_df = explode_sites(df, 'asc_sites', 'asc_site')
+    sim_df = explode_sites(df, 'sim_sites', 'sim_site')
 
     return (asc_df, sim_df)
 
+
+def create_tables(con):
+    # tables made by older runs through pandas have no keys but are still upserted by ecosite_id below
+    eco_cols = ', '.join([' '.join((x, 'TEXT')) for x in ECO_COLUMNS[1:]])
+    con.execute(f'CREATE TABLE IF NOT EXISTS general_info (ecosite_id TEXT PRIMARY KEY, {eco_cols}, '
+                'pz_l REAL, pz_h REAL, plants TEXT);')
+    con.execute('CREATE TABLE IF NOT EXISTS sites_associated (mlra TEXT, ecosite_id TEXT, asc_site TEXT, '
+                'PRIMARY KEY (ecosite_id, asc_site));')
+    con.execute('CREATE TABLE IF NOT EXISTS sites_similar (mlra TEXT, ecosite_id TEXT, sim_site TEXT, '
+                'PRIMARY KEY (ecosite_id, sim_site));')
+    con.commit()
+
+
+def create_ledger(con):
+    con.execute('CREATE TABLE IF NOT EXISTS ingest_ledger (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                'sha256 TEXT, ecosite_id TEXT);')
+    con.commit()
+
+
+def read_ledger(con):
+    rows = con.execute('SELECT path, mtime, size, sha256 FROM ingest_ledger;').fetchall()
+    return {x[0]: (x[1], x[2], x[3]) for x in rows}
+
+
+def update_ledger(con, sources):
+    rows = [(x.get('path'), x.get('mtime'), x.get('size'), x.get('sha256'), x.get('ecosite_id')) for x in sources]
+    con.executemany('INSERT OR REPLACE INTO ingest_ledger VALUES (?, ?, ?, ?, ?);', rows)
+    con.commit()
+
+
+def changed_ecosites(batch, ledger):
+    # a file touched without its content changing only needs its ledger entry refreshed; an ecosite found in
+    # more than one file (e.g. two download trees under scanpath) is kept once, from the last file read
+    changed = {}
+    for x in batch:
+        if ledger.get(x['source']['path'], (None, None, None))[2] != x['source']['sha256']:
+            changed.pop(x['ecosite_id'], None)
+            changed[x['ecosite_id']] = x
+    return list(changed.values())
+
+
+def open_sqlite(path, check_same_thread = True):
+    con = sqlite.connect(path, check_same_thread = check_same_thread)
+    # WAL lets readers keep querying while a load runs; NORMAL sync is safe with WAL and far fewer fsyncs
+    con.execute('PRAGMA journal_mode = WAL;')
+    con.execute('PRAGMA synchronous = NORMAL;')
+    con.execute('PRAGMA temp_store = MEMORY;')
+    con.execute('PRAGMA cache_size = -65536;')
+    return con
+
+
+def insert_rows(con, tbl, df):
+    cols = ', '.join(df.columns)
+    marks = ', '.join(['?'] * len(df.columns))
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    con.executemany(f'INSERT INTO {tbl} ({cols}) VALUES ({marks});', rows)
+
+
+def write_sqlite(con, eco_df):
+    # each ecosite's rows are replaced as a whole so sites dropped from a changed file disappear too; the
+    # whole batch is one transaction
+    ids = [(x,) for x in eco_df['ecosite_id'].unique()]
+    asc_sites, sim_sites = split_sites(df=eco_df)
+    with con:
+        for tbl in ['general_info', 'sites_associated', 'sites_similar']:
+            con.executemany(f'DELETE FROM {tbl} WHERE ecosite_id = ?;', ids)
+        insert_rows(con, 'general_info', eco_df)
+        insert_rows(con, 'sites_associated', asc_sites)
+        insert_rows(con, 'sites_similar', sim_sites)
+
+
+def snake_case(name):
+    return re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', str(name)).replace('-', '_').replace(' ', '_').lower()
+
+
+def flatten_record(d, prefix = ''):
+    flat = {}
+    for k, v in d.items():
+        key = '_'.join((prefix, snake_case(k))) if prefix else snake_case(k)
+        if isinstance(v, dict):
+            flat.update(flatten_record(v, key))
+        elif isinstance(v, list):
+            flat[key] = json.dumps(v, ensure_ascii=False)
+        else:
+            flat[key] = v
+    return flat
+
+
+def table_records(d):
+    # plant community tables come either as a bare list of rows or as an object holding one
+    if isinstance(d, list):
+        return [x for x in d if isinstance(x, dict)]
+    if isinstance(d, dict):
+        for v in d.values():
+            if isinstance(v, list) and all([isinstance(x, dict) for x in v]):
+                return v
+    return []
+
+
+def write_community(con, tbl, ecosite_id, land_use, state, community, d):
+    # rows are keyed by the ecosite and community they describe; columns follow the table's JSON fields and
+    # are added as new fields appear
+    keys = {'ecosite_id': ecosite_id, 'mlra': ecosite_id[1:5], 'land_use': str(land_use), 'state': str(state),
+            'community': str(community)}
+    records = [keys | {k: v for k, v in flatten_record(x).items() if k not in keys} for x in table_records(d)]
+    with con:
+        con.execute(f'CREATE TABLE IF NOT EXISTS {tbl} (ecosite_id TEXT, mlra TEXT, land_use TEXT, state TEXT, '
+                    'community TEXT);')
+        con.execute(f'DELETE FROM {tbl} WHERE ecosite_id = ? AND land_use = ? AND state = ? AND community = ?;',
+                    (ecosite_id, keys['land_use'], keys['state'], keys['community']))
+        if not records:
+            return 0
+        cols = [x[1] for x in con.execute(f'PRAGMA table_info({tbl});').fetchall()]
+        for r in records:
+            for k in r.keys():
+                if k not in cols:
+                    con.execute(f'ALTER TABLE {tbl} ADD COLUMN "{k}";')
+                    cols.append(k)
+        for r in records:
+            names = ', '.join([f'"{k}"' for k in r.keys()])
+            marks = ', '.join(['?'] * len(r))
+            con.execute(f'INSERT INTO {tbl} ({names}) VALUES ({marks});', list(r.values()))
+    return len(records)
+
+
+def write_parquet(outpath, eco_df):
+    # one dataset per table under `outpath`, hive partitioned by mlra; each partition holds a single file that
+    # is rewritten with the batch's ecosites replacing any earlier copies
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit('pyarrow is required for Parquet output (pip install pyarrow).')
+    asc_sites, sim_sites = split_sites(df=eco_df)
+    eco_ids = eco_df.groupby('mlra', sort=False)['ecosite_id']
+    for tbl, df in [('general_info', eco_df), ('sites_associated', asc_sites), ('sites_similar', sim_sites)]:
+        parts = dict(list(df.groupby('mlra', sort=False)))
+        # every partition holding one of the batch's ecosites is rewritten, including those the batch has no
+        # rows for, so sites removed from an ecosite are dropped from the dataset
+        for mlra, ids in eco_ids:
+            part_dir = os.path.join(outpath, tbl, '='.join(('mlra', str(mlra))))
+            part_path = os.path.join(part_dir, 'part-0.parquet')
+            part = parts.get(mlra, df.iloc[0:0]).drop(columns='mlra')
+            if os.path.isfile(part_path):
+                old_part = pq.read_table(part_path).to_pandas()
+                old_part = old_part[~old_part['ecosite_id'].isin(ids)]
+                part = pd.concat([old_part, part], ignore_index=True)
+            elif part.empty:
+                continue
+            os.makedirs(part_dir, exist_ok=True)
+            table = pa.Table.from_pandas(part.astype(object).where(part.notna(), None), preserve_index=False)
+            # a fixed type per column keeps every partition's schema the same; repeated strings (names,
+            # species, plant codes, site symbols) are stored as dictionaries
+            fields = []
+            for name in table.column_names:
+                if name in PARQUET_DICT_COLUMNS:
+                    fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+                elif name in ['pz_l', 'pz_h']:
+                    fields.append(pa.field(name, pa.float64()))
+                else:
+                    fields.append(pa.field(name, pa.string()))
+            table = table.cast(pa.schema(fields))
+            tmp_path = '.'.join((part_path, 'part'))
+            pq.write_table(table, tmp_path, compression='zstd')
+            os.replace(tmp_path, part_path)
+
+
+def create_indexes(con):
+    # built once loading is done; tables downstream scripts create from these (see sql/) are indexed too
+    # when they exist
+    tbls = [x[0] for x in con.execute("SELECT name FROM sqlite_master WHERE type = 'table';").fetchall()]
+    for tbl in ['general_info', 'sites_associated', 'sites_similar', 'annual_production', 'plant_composition',
+                'general_plants', 'ecosite_wide']:
+        if tbl not in tbls:
+            continue
+        info = con.execute(f'PRAGMA table_info({tbl});').fetchall()
+        cols = [x[1] for x in info]
+        # a primary key led by ecosite_id already serves as its index
+        lead_key = [x[1] for x in info if x[5] == 1]
+        if 'ecosite_id' in cols and lead_key != ['ecosite_id']:
+            con.execute(f'CREATE INDEX IF NOT EXISTS idx_{tbl}_ecosite_id ON {tbl} (ecosite_id);')
+        if 'mlra' in cols:
+            con.execute(f'CREATE INDEX IF NOT EXISTS idx_{tbl}_mlra ON {tbl} (mlra);')
+    con.execute('ANALYZE;')
+    con.commit()
+
+
 if __name__ == "__main__":
     argv = sys.argv[1:]
     
@@ -106,8 +406,9 @@ if __name__ == "__main__":
                                                  ' files.')
     parser.add_argument('scanpath', help='directory to recursively scan for ecosite JSON files')
     parser.add_argument('outpath', 
-                        help='path where the combined table will be saved with a ".csv" for CSV or '
-                             'c(".db", ".sqlite") extention for SQLite.')
+                        help='path where the combined table will be saved with a ".csv" for CSV, ".parquet" '
+                             'for a Parquet dataset directory partitioned by MLRA or c(".db", ".sqlite") '
+                             'extention for SQLite.')
     #  species = parser.add_argument_group('species','USDA PLANTS species table import options')
     #  ex_species = species.add_mutually_exclusive_group()
     #  ex_species.add_argument('-s', '--species_csv',
@@ -117,9 +418,46 @@ if __name__ == "__main__":
     #                          help = 'path to a sqlite database containing species information')
     #  species.add_argument('-t', '--table_name',
     #                       help='in the case of a database path, name of the databse table to use')
+    parser.add_argument('-j', '--processes', type = int,
+                        help = 'number of processes parsing ecosite files (default: one per CPU)')
+    parser.add_argument('-b', '--batch_size', type = int, default = 5000,
+                        help = 'number of ecosites converted and written at a time (default: %(default)s)')
+    parser.add_argument('-f', '--full', action = 'store_true',
+                        help = 'read every ecosite file, not only those changed since the last run into '
+                               '`outpath`')
+    parser.add_argument('--format', choices = ['csv', 'parquet', 'sqlite'],
+                        help = 'output format, if not given by the `outpath` extension')
     args = parser.parse_args(argv)
 
-    elist = scan_ecojson(path=args.scanpath)
+    out_format = args.format
+    if out_format is None:
+        out_ext = os.path.splitext(args.outpath)[1]
+        if out_ext == '.csv':
+            out_format = 'csv'
+        elif out_ext == '.parquet':
+            out_format = 'parquet'
+        else:
+            out_format = 'sqlite'
+
+    # the ingest ledger lives in the output database, beside a CSV output or inside a Parquet directory
+    if out_format == 'csv':
+        con = sqlite.connect('.'.join((args.outpath, 'ledger')))
+        existing_csv = os.path.isfile(args.outpath)
+        header = not existing_csv
+        dedupe_csv = existing_csv
+    elif out_format == 'parquet':
+        os.makedirs(args.outpath, exist_ok=True)
+        con = sqlite.connect(os.path.join(args.outpath, '_ledger.sqlite'))
+    else:
+        con = open_sqlite(args.outpath)
+        create_tables(con)
+    create_ledger(con)
+    if args.full:
+        ledger = {}
+    else:
+        ledger = read_ledger(con)
+
+    elist = scan_ecojson(path=args.scanpath, processes=args.processes, ledger=ledger)
 
     #  if args.species_csv:
     #      species_df = pd.read_csv(args.species_csv)
@@ -131,24 +469,33 @@ if __name__ == "__main__":
     #  else:
     #      species_df = None
 
-    eco_df = convert_ecolist_df(ecolist = elist, sp_df = None) 
-
-    if os.path.splitext(args.outpath)[1] == '.csv':
-        if os.path.isfile(args.outpath):
-            eco_df.to_csv(args.outpath, header=False, index=False, mode='a')
-        else:
-            eco_df.to_csv(args.outpath, header=True, index=False, mode='w')
-    else:
-        con = sqlite.connect(args.outpath)
-        nrows = eco_df.to_sql(name='general_info', con=con, index=False, if_exists='append')
-        asc_sites, sim_sites = split_sites(df=eco_df)
-        if not asc_sites.empty:
-            a_nrows = asc_sites.to_sql(name='sites_associated', con=con, index=False, 
-                                       if_exists='append')
-        if not sim_sites.empty:
-            s_nrows = sim_sites.to_sql(name='sites_similar', con=con, index=False, 
-                                       if_exists='append')
-        con.close()
+    n_changed = 0
+    written = set()
+    for batch in batched(elist, args.batch_size):
+        changed = changed_ecosites(batch, ledger)
+        if changed:
+            n_changed += len(changed)
+            eco_df = convert_ecolist_df(ecolist = changed, sp_df = None)
+            if out_format == 'csv':
+                eco_df.to_csv(args.outpath, header=header, index=False, mode='a')
+                header = False
+                # an ecosite found again in a later batch is appended a second time
+                ids = {x['ecosite_id'] for x in changed}
+                if not ids.isdisjoint(written):
+                    dedupe_csv = True
+                written |= ids
+            elif out_format == 'parquet':
+                write_parquet(args.outpath, eco_df)
+            else:
+                write_sqlite(con, eco_df)
+        update_ledger(con, [x['source'] for x in batch])
+    if out_format == 'csv' and dedupe_csv and n_changed:
+        # rows for re-read or repeated ecosites were appended, so the earlier copies are dropped
+        csv_df = pd.read_csv(args.outpath, dtype=str, keep_default_na=False)
+        csv_df.drop_duplicates(subset='ecosite_id', keep='last').to_csv(args.outpath, header=True, index=False)
+    if out_format == 'sqlite':
+        create_indexes(con)
+    con.close()
+    print(n_changed, 'ecosites added or updated.')
 
     print('\nScript finished.\n')
-
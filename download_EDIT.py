@@ -1,70 +1,625 @@
 #!/usr/bin/env python3
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
+import hashlib
 import json
+import logging
 import os
+import random
+import re
 import sys
+import threading
+import time
+import sqlite3 as sqlite
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.parse import urlparse
+from edit_store import FileStore, NullStore, PackStore
+
+# tqdm is only needed for the optional progress bar
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+log = logging.getLogger('download_EDIT')
+
+# EDIT service root; --base_url points the crawl at a mirror or a local stand-in (see benchmarks/mock_edit.py)
+EDIT_URL = 'https://edit.jornada.nmsu.edu'
+
+# ecoclass ids start with the site type and the geoUnit they belong to (e.g. R010XY001OR)
+ECOCLASS_PAT = re.compile(r'^[FRG](\d{3}[A-Z]).+')
+
+# maximum number of simultaneous requests made to any one host, regardless of crawl concurrency
+HOST_LIMIT = 4
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+# one keep-alive session is shared by every request so connections to EDIT are reused between files
+POOL_SIZE = 10
+_session = None
+_session_lock = threading.Lock()
+
+# record of every file written and of the crawl's file tasks, used to validate local copies against EDIT
+# on incremental runs and to pick up an interrupted crawl where it stopped
+MANIFEST_NAME = 'edit_manifest.sqlite'
+_manifest = None
+_incremental = False
+_resume = False
+
+# optional database that parsed ecoclass and community responses are written to as they arrive, and
+# whether the file tree is written at all
+COMMUNITY_TABLES = {'annual-production.json': 'annual_production',
+                    'rangeland-plant-composition.json': 'plant_composition'}
+_sink = None
+_write_files = True
+
+# where downloaded files are kept: the directory tree (FileStore), per-geoUnit packs (PackStore) or nowhere
+# when only a database is loaded (NullStore)
+_store = None
+_default_store = FileStore('.')
+# JSON files written to the store this run, the only ones --pretty re-indents
+_saved_json = set()
+_saved_lock = threading.Lock()
+
+# bytes read from the network per write when streaming a file to disk
+CHUNK_SIZE = 64 * 1024
+
+# retry policy for transient failures; 404s are answers, not failures, and are never retried
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+TIMEOUT = (10, 120)
+_limiter = None
+_breaker = None
+_failed = {}
+_failed_lock = threading.Lock()
+
+# request planning: with pruning on, tables that never exist for a site type (R rangeland, F forest) and
+# endpoints that returned 404 for every one of at least PLAN_MIN_SAMPLES earlier requests are not requested;
+# the first and then every PLAN_REPROBE-th job of such an endpoint is still sent, so a table EDIT fills in
+# later shows up in the statistics and stops being pruned
+SITE_TYPE_SKIP = {'R': ['forest-overstory.json', 'forest-understory.json', 'snag-count.json'],
+                  'F': ['rangeland-plant-composition.json']}
+PLAN_MIN_SAMPLES = 20
+PLAN_REPROBE = 50
+_prune = False
+_endpoint_stats = {}
+_reprobe = {}
+_planned_out = 0
+_plan_lock = threading.Lock()
+
+# discovery metadata (the geoUnit catalog, class lists and model states) is kept in the manifest and reused
+# for CACHE_TTL hours instead of being requested again; an offline plan reads it regardless of age
+CACHE_TTL = 24
+_cache_ttl = CACHE_TTL
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+# run instrumentation: per-endpoint request, retry and 404 counts, bytes and latency histograms (upper
+# bounds in seconds), written to REPORT_NAME in the outpath root at the end of a download
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+REPORT_NAME = 'edit_run_report.json'
+_metrics = None
+
+
+def new_session(pool_size = POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = pool_size, pool_block = True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = new_session(POOL_SIZE)
+        return _session
+
+
+def set_pool_size(pool_size):
+    global _session, POOL_SIZE
+    with _session_lock:
+        POOL_SIZE = max(1, pool_size)
+        if _session is not None:
+            _session.close()
+        _session = new_session(POOL_SIZE)
+
+
+class TokenBucket:
+    # allows `rate` requests per second on average with bursts of up to `capacity`
+    def __init__(self, rate, capacity = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    # pauses every request for `cooldown` seconds once the share of failed attempts among the last `window`
+    # reaches `threshold`, giving an overloaded service room to recover
+    def __init__(self, threshold = 0.5, window = 20, cooldown = 30.0):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.outcomes = []
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, success):
+        with self.lock:
+            self.outcomes.append(success)
+            del self.outcomes[:-self.window]
+            if len(self.outcomes) >= self.window // 2:
+                error_rate = self.outcomes.count(False) / len(self.outcomes)
+                if error_rate >= self.threshold and time.monotonic() >= self.open_until:
+                    log.warning('Error rate %d%%; pausing requests for %s seconds.', round(error_rate * 100),
+                                self.cooldown)
+                    self.open_until = time.monotonic() + self.cooldown
+                    self.outcomes = []
+
+
+def set_throttle(rate = None, max_attempts = MAX_ATTEMPTS, cooldown = 30.0):
+    global _limiter, _breaker, MAX_ATTEMPTS
+    if rate:
+        _limiter = TokenBucket(rate)
+    else:
+        _limiter = None
+    _breaker = CircuitBreaker(cooldown = cooldown)
+    MAX_ATTEMPTS = max(1, max_attempts)
+    with _failed_lock:
+        _failed.clear()
+
+
+def retry_delay(attempt, r = None):
+    # Retry-After (seconds or an HTTP date) wins when the server sends one, capped at BACKOFF_MAX so one
+    # header cannot park a worker for hours, otherwise exponential backoff with jitter so parallel workers do
+    # not retry in lockstep
+    if r is not None and r.headers.get('Retry-After'):
+        retry_after = r.headers.get('Retry-After')
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                return min(BACKOFF_MAX, max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc))
+                                                 .total_seconds()))
+            except (TypeError, ValueError):
+                pass
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class CrawlMetrics:
+    # counters are kept per endpoint (the file name part of the link template, e.g. states.json), so slow or
+    # mostly missing tables stand out; every HTTP attempt is timed from request to last byte
+    def __init__(self, progress = False):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.endpoints = {}
+        self.bar = None
+        if progress:
+            if tqdm is None:
+                log.warning('tqdm is not installed; no progress bar will be shown.')
+            else:
+                self.bar = tqdm(total = 0, unit = 'file', dynamic_ncols = True)
+
+    def endpoint(self, name):
+        e = self.endpoints.get(name)
+        if e is None:
+            e = {'requests': 0, 'ok': 0, 'not_modified': 0, 'not_found': 0, 'errors': 0, 'retries': 0,
+                 'failed': 0, 'cached': 0, 'files': 0, 'bytes': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                 'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+            self.endpoints[name] = e
+        return e
+
+    def request(self, name, status, seconds, size = 0):
+        i = 0
+        while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+            i += 1
+        with self.lock:
+            e = self.endpoint(name)
+            e['requests'] += 1
+            e['seconds'] += seconds
+            e['max_seconds'] = max(e['max_seconds'], seconds)
+            e['histogram'][i] += 1
+            e['bytes'] += size
+            if status is None or status in RETRY_STATUS or (status >= 400 and status != 404):
+                e['errors'] += 1
+            elif status == 404:
+                e['not_found'] += 1
+            elif status == 304:
+                e['not_modified'] += 1
+            else:
+                e['ok'] += 1
+
+    def count(self, name, key):
+        with self.lock:
+            self.endpoint(name)[key] += 1
+
+    def saved(self, name):
+        self.count(name, 'files')
+
+    def add_total(self, n):
+        if self.bar is not None and n:
+            with self.lock:
+                self.bar.total += n
+                self.bar.refresh()
+
+    def advance(self):
+        if self.bar is not None:
+            with self.lock:
+                self.bar.update(1)
+
+    def percentile(self, e, q):
+        # upper bound of the bucket holding the q-th quantile; the overflow bucket reports the slowest request
+        target = q * e['requests']
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, e['histogram']):
+            seen += n
+            if n and seen >= target:
+                return bound
+        return round(e['max_seconds'], 3)
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        with self.lock:
+            endpoints = {}
+            for name, e in sorted(self.endpoints.items()):
+                d = dict(e)
+                d['histogram'] = dict(zip([str(b) for b in LATENCY_BUCKETS] + ['inf'], e['histogram']))
+                d['mean_seconds'] = round(e['seconds'] / e['requests'], 4) if e['requests'] else None
+                d['p50_seconds'] = self.percentile(e, 0.5) if e['requests'] else None
+                d['p95_seconds'] = self.percentile(e, 0.95) if e['requests'] else None
+                d['seconds'] = round(e['seconds'], 3)
+                d['max_seconds'] = round(e['max_seconds'], 3)
+                endpoints[name] = d
+        totals = {k: sum([e[k] for e in endpoints.values()]) for k in
+                  ['requests', 'ok', 'not_modified', 'not_found', 'errors', 'retries', 'failed', 'cached', 'files',
+                   'bytes']}
+        totals['elapsed_seconds'] = round(elapsed, 3)
+        totals['files_per_second'] = round(totals['files'] / elapsed, 3) if elapsed else None
+        totals['requests_per_second'] = round(totals['requests'] / elapsed, 3) if elapsed else None
+        totals['bytes_per_second'] = round(totals['bytes'] / elapsed) if elapsed else None
+        return {'totals': totals, 'endpoints': endpoints}
+
+    def close(self):
+        if self.bar is not None:
+            self.bar.close()
+            self.bar = None
+
+
+class ProgressHandler(logging.StreamHandler):
+    # log lines are written through tqdm so they do not break up the progress bar
+    def emit(self, record):
+        try:
+            tqdm.write(self.format(record), file = self.stream)
+        except Exception:
+            self.handleError(record)
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = CrawlMetrics()
+    return _metrics
+
+
+def open_metrics(progress = False):
+    global _metrics
+    close_metrics()
+    _metrics = CrawlMetrics(progress = progress)
+    return _metrics
+
+
+def close_metrics():
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+    _metrics = None
+
+
+def endpoint_name(endpoint):
+    # the level a link template belongs to (its last placeholder, or the catalog) and what follows it, e.g.
+    # '{ecoclass}.json' -> 'ecoclass/json' and '{landUse}/{state}/{community}/snag-count.json' ->
+    # 'community/snag-count.json'
+    if endpoint is None:
+        return 'other'
+    fields = re.findall(r'\{(\w+)\}', endpoint)
+    level = fields[-1] if fields else 'catalog'
+    return '/'.join((level, re.sub(r'^.*\}', '', endpoint).lstrip('/.')))
+
+
+def write_report(path, report):
+    write_atomic(path, json.dumps(report, indent = 4))
+
+
+def log_report(report):
+    totals = report.get('totals')
+    log.info('%d requests (%d retries, %d not found, %d errors) in %.1fs; %d files saved, %d reused, %.1f MB, '
+             '%.2f files/s', totals['requests'], totals['retries'], totals['not_found'], totals['errors'],
+             totals['elapsed_seconds'], totals['files'], totals['cached'], totals['bytes'] / 1e6,
+             totals['files_per_second'] or 0)
+    for name, e in report.get('endpoints').items():
+        if e['requests']:
+            log.info('\t%-36s %6d req %5d 404 %4d retry  mean %6.3fs  p95 <= %ss', name, e['requests'],
+                     e['not_found'], e['retries'], e['mean_seconds'], e['p95_seconds'])
+
+
+def record_failure(link, reason):
+    with _failed_lock:
+        _failed[link] = reason
+
+
+def failed_urls():
+    with _failed_lock:
+        return dict(_failed)
+
+
+class Manifest:
+    def __init__(self, root, resume = False):
+        self.root = root
+        self.lock = threading.Lock()
+        Path(root).mkdir(parents=True, exist_ok=True)
+        self.con = sqlite.connect(os.path.join(root, MANIFEST_NAME), check_same_thread=False)
+        # commits come several per file from every worker; WAL with NORMAL sync makes them appends without an
+        # fsync each
+        self.con.execute('PRAGMA journal_mode = WAL;')
+        self.con.execute('PRAGMA synchronous = NORMAL;')
+        self.con.execute('CREATE TABLE IF NOT EXISTS files (url TEXT PRIMARY KEY, path TEXT, etag TEXT, '
+                         'last_modified TEXT, size INTEGER, sha256 TEXT, fetched TEXT);')
+        self.con.execute('CREATE TABLE IF NOT EXISTS tasks (url TEXT PRIMARY KEY, path TEXT, geoUnit TEXT, '
+                         'ecoclass TEXT, community TEXT, status TEXT, updated TEXT);')
+        self.con.execute('CREATE TABLE IF NOT EXISTS endpoint_stats (endpoint TEXT, site_type TEXT, '
+                         'requests INTEGER, not_found INTEGER, PRIMARY KEY (endpoint, site_type));')
+        self.con.execute('CREATE TABLE IF NOT EXISTS metadata (url TEXT PRIMARY KEY, fetched REAL, body TEXT);')
+        if not resume:
+            self.con.execute('DELETE FROM tasks;')
+        self.con.commit()
+
+    def get(self, url):
+        with self.lock:
+            row = self.con.execute('SELECT path, etag, last_modified, size, sha256 FROM files WHERE url = ?;',
+                                   (url,)).fetchone()
+        if row is None:
+            return None
+        return {'path': os.path.join(self.root, row[0]), 'etag': row[1], 'last_modified': row[2],
+                'size': row[3], 'sha256': row[4]}
+
+    def record(self, url, path, etag, last_modified, size, sha256):
+        fetched = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        rel_path = os.path.relpath(path, self.root)
+        with self.lock:
+            self.con.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?);',
+                             (url, rel_path, etag, last_modified, size, sha256, fetched))
+            self.con.commit()
+
+    def enqueue(self, jobs):
+        updated = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        rows = [(j.get('link'), os.path.relpath(j.get('path'), self.root), j.get('geoUnit'), j.get('ecoclass'),
+                 j.get('community'), 'pending', updated) for j in jobs]
+        with self.lock:
+            # tasks already known (e.g. completed before an interruption) keep their status
+            self.con.executemany('INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?);', rows)
+            self.con.commit()
+
+    def task_status(self, url):
+        with self.lock:
+            row = self.con.execute('SELECT status FROM tasks WHERE url = ?;', (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def finish(self, url, status):
+        updated = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with self.lock:
+            self.con.execute('UPDATE tasks SET status = ?, updated = ? WHERE url = ?;', (status, updated, url))
+            self.con.commit()
+
+    def record_endpoint(self, endpoint, site_type, found):
+        not_found = 0 if found else 1
+        with self.lock:
+            self.con.execute('INSERT INTO endpoint_stats VALUES (?, ?, 1, ?) ON CONFLICT (endpoint, site_type) '
+                             'DO UPDATE SET requests = requests + 1, not_found = not_found + excluded.not_found;',
+                             (endpoint, site_type, not_found))
+            self.con.commit()
+
+    def endpoint_stats(self):
+        with self.lock:
+            rows = self.con.execute('SELECT endpoint, site_type, requests, not_found FROM endpoint_stats;')\
+                   .fetchall()
+        return {(x[0], x[1]): (x[2], x[3]) for x in rows}
+
+    def metadata(self):
+        with self.lock:
+            rows = self.con.execute('SELECT url, fetched, body FROM metadata;').fetchall()
+        return {x[0]: (x[1], x[2]) for x in rows}
+
+    def record_metadata(self, url, fetched, body):
+        with self.lock:
+            self.con.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?);', (url, fetched, body))
+            self.con.commit()
+
+    def task_counts(self):
+        with self.lock:
+            rows = self.con.execute('SELECT status, count(*) FROM tasks GROUP BY status ORDER BY status;')\
+                   .fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+
+def open_manifest(root, incremental = False, resume = False):
+    global _manifest, _incremental, _resume
+    close_manifest()
+    _manifest = Manifest(root, resume=resume)
+    _incremental = incremental
+    _resume = resume
+    return _manifest
+
+
+def close_manifest():
+    global _manifest, _incremental, _resume
+    if _manifest is not None:
+        _manifest.close()
+    _manifest = None
+    _incremental = False
+    _resume = False
+
+
+class DatabaseSink:
+    def __init__(self, db_path):
+        # imported here so downloading files alone does not need pandas
+        import combine_json
+        self.cj = combine_json
+        self.lock = threading.Lock()
+        self.con = combine_json.open_sqlite(db_path, check_same_thread = False)
+        combine_json.create_tables(self.con)
+
+    def write_ecoclass(self, ecoclass, d):
+        eco_df = self.cj.convert_ecolist_df([self.cj.parse_ecojson(ecoclass, d)])
+        with self.lock:
+            self.cj.write_sqlite(self.con, eco_df)
+
+    def write_community(self, tbl, ecoclass, landUse, state, community, d):
+        with self.lock:
+            self.cj.write_community(self.con, tbl, ecoclass, landUse, state, community, d)
+
+    def close(self):
+        with self.lock:
+            self.cj.create_indexes(self.con)
+            self.con.close()
+
+
+def open_sink(db_path = None, write_files = True):
+    global _sink, _write_files
+    close_sink()
+    if db_path:
+        _sink = DatabaseSink(db_path)
+    _write_files = write_files
+    return _sink
+
+
+def close_sink():
+    global _sink, _write_files
+    if _sink is not None:
+        _sink.close()
+    _sink = None
+    _write_files = True
+
+
+def get_store():
+    if _store is not None:
+        return _store
+    return _default_store
+
+
+def open_store(root, kind = 'files'):
+    global _store
+    close_store()
+    if not _write_files:
+        _store = NullStore(root)
+    elif kind == 'pack':
+        _store = PackStore(root)
+    else:
+        _store = FileStore(root)
+    with _saved_lock:
+        _saved_json.clear()
+    return _store
+
+
+def close_store():
+    global _store
+    if _store is not None:
+        _store.close()
+    _store = None
+
+
+class LocalResult:
+    # stands in for a response whose body is saved at `path` (streamed this run, a 304, or a task finished
+    # before a resumed run), so callers can treat it like any other successful response
+    def __init__(self, link, path, status_code = 304):
+        self.url = link
+        self.path = path
+        self.status_code = status_code
+
+    def __bool__(self):
+        return True
+
+    def json(self):
+        return json.loads(get_store().read(self.path))
+
+
+def write_atomic(path, data, mode = 'w'):
+    # written beside the target and renamed into place so an interrupted write never looks complete
+    tmp_path = '.'.join((path, 'part'))
+    if 'b' in mode:
+        with open(tmp_path, mode) as f:
+            f.write(data)
+    else:
+        with open(tmp_path, mode, encoding='utf-8') as f:
+            f.write(data)
+    os.replace(tmp_path, path)
+
 
 def get_ecolist(path):
     with open(path, 'r') as f:
-        lines = [line.rstrip().strip("\"\'") for line in f]    
-    return lines
-
-def get_from_edit(ecolist, save_path):
-    l = 'https://edit.jornada.nmsu.edu/services/descriptions/{catalog}/{geoUnit}/{ecoclass}'
-    lp = 'https://edit.jornada.nmsu.edu/services/downloads/{catalog}/{geoUnit}/{item}' 
-    esd_pat = re.compile('^[FRG](\d{3}[A-Z]).+')
-    for ecoclass in ecolist:
-        print('Downloading ', ecoclass, '...', sep = '')
-        var_dict = {'catalog': 'esd', 'ecoclass': ecoclass}
-        matches = esd_pat.findall(ecoclass)
-        if matches:
-            var_dict['geoUnit'] = matches[0]
-            link = '.'.join((l.format(**var_dict), 'json'))
-            r = requests.get(link, headers={'Accept': 'application/json'})
-            eco_json = r.json()
-            if eco_json.keys():
-                if list(eco_json.keys())[0] != 'error':
-                    # create folder
-                    new_dir = os.path.join(save_path, ecoclass)
-                    Path(new_dir).mkdir(parents=True, exist_ok=True)
-
-                    # write json
-                    json_fname = '.'.join((ecoclass, 'json'))
-                    json_path = os.path.join(new_dir, json_fname)
-                    with open(json_path, 'w', encoding='utf-8') as f:
-                        json.dump(eco_json, f, ensure_ascii=False, indent = 4)
-                    print("\tJSON success.")
-                    
-                    # write pdf
-                    link_pdf = '.'.join((l.format(**var_dict), 'pdf'))
-                    pdf_fname = '.'.join((ecoclass, 'pdf'))
-                    pdf_path = os.path.join(new_dir, pdf_fname)
-                    r_pdf = requests.get(link_pdf)
-                    with open(pdf_path, 'wb') as f:
-                        f.write(r_pdf.content)
-                    print("\tPDF success.")
-
-                    # write production
-                    var_dict['item'] = 'annual-production.txt'
-                    link_prod = lp.format(**var_dict)
-                    prod_fname = '_'.join((var_dict['geoUnit'], var_dict['item']))
-                    prod_path = os.path.join(save_path, prod_fname)
-                    r_prod = requests.get(link_prod)
-                    with open(prod_path, 'w', encoding='utf-8') as f:
-                        f.write(r_prod.text)
-                    print("\tProduction success.")
+        lines = [line.strip().strip("\"\'") for line in f]
+    return [x for x in lines if x]
 
-                else:
-                    print('\t', eco_json, sep = '')
-            else:
-                print('\tEmpty response.')
-        else:
-            print('\tCouldnt match geoUnit.')
+
+def host_slot(link):
+    host = urlparse(link).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(HOST_LIMIT)
+            _host_slots[host] = slot
+    return slot
+
+
+def set_base_url(url):
+    global EDIT_URL
+    EDIT_URL = url.rstrip('/')
 
 
-def send_request(link, path, save = True):
+def set_host_limit(limit):
+    global HOST_LIMIT
+    with _host_slots_lock:
+        HOST_LIMIT = max(1, limit)
+        _host_slots.clear()
+
+
+def send_request(link, path, save = True, endpoint = None):
     l_ext = os.path.splitext(link)[1]
     if l_ext == '.txt':
         headers = {'Accept': 'text/tab-separated-values'}
@@ -73,59 +628,314 @@ def send_request(link, path, save = True):
     elif l_ext == '.pdf':
         headers={'Accept': 'application/pdf'}
     else:
-        print(l_ext, 'not one of [.txt, .pdf, .json]')
+        log.warning('%s not one of [.txt, .pdf, .json]', l_ext)
         return None
 
-    r = requests.get(link, headers = headers)
+    cached = None
+    if save and _incremental and _manifest is not None:
+        cached = _manifest.get(link)
+        if cached and get_store().exists(path):
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached.get('etag')
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached.get('last_modified')
+        else:
+            cached = None
+
+    # saved files are streamed to disk in chunks while the connection (and host slot) is held, so memory
+    # use does not grow with file size
+    name = endpoint_name(endpoint)
+    metrics = get_metrics()
+    r = None
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        if _breaker is not None:
+            _breaker.wait()
+        if _limiter is not None:
+            _limiter.acquire()
+        r = None
+        reason = None
+        status = None
+        size = 0
+        try:
+            with host_slot(link):
+                # latency is timed from when the host slot is free, so it reports EDIT's response time and
+                # not the queueing behind --host_limit
+                start = time.perf_counter()
+                r = get_session().get(link, headers = headers, stream = save, timeout = TIMEOUT)
+                if r.status_code in RETRY_STATUS:
+                    r.close()
+                    reason = ' '.join((str(r.status_code), str(r.reason)))
+                elif save and r and r.status_code != 304:
+                    tmp_path, size, digest = stream_to_file(r, path)
+                elif not save:
+                    size = len(r.content)
+                status = r.status_code
+        except requests.RequestException as e:
+            reason = type(e).__name__
+        metrics.request(name, status, time.perf_counter() - start, size)
+        if reason is None:
+            if _breaker is not None:
+                _breaker.record(True)
+            break
+        if _breaker is not None:
+            _breaker.record(False)
+        if attempt < MAX_ATTEMPTS:
+            delay = retry_delay(attempt, r)
+            metrics.count(name, 'retries')
+            log.warning('Retrying %s in %.1fs (%s)', link, delay, reason)
+            time.sleep(delay)
+    else:
+        record_failure(link, reason)
+        metrics.count(name, 'failed')
+        log.error('Could not retrieve content after %d attempts (%s): %s', MAX_ATTEMPTS, reason, link)
+        return r
+
+    if r.status_code == 304:
+        r.close()
+        log.debug('Not modified %s', path)
+        return LocalResult(link, path)
     if not r:
-        print('Could not retrieve content.')
+        r.close()
+        if r.status_code == 404:
+            log.debug('Page not found: %s', link)
+        else:
+            record_failure(link, ' '.join((str(r.status_code), str(r.reason))))
+            metrics.count(name, 'failed')
+            log.warning('Could not retrieve content (%d %s): %s', r.status_code, r.reason, link)
+        return r
+    if not save:
         return r
+
+    if cached and cached.get('sha256') == digest:
+        os.remove(tmp_path)
+        log.debug('Unchanged %s', path)
+        return LocalResult(link, path, status_code = r.status_code)
+    log.debug('Saving %s', path)
+    get_store().put(path, tmp_path)
+    metrics.saved(name)
+    if l_ext == '.json':
+        with _saved_lock:
+            _saved_json.add(path)
+    if _manifest is not None:
+        _manifest.record(url = link, path = path, etag = r.headers.get('ETag'),
+                         last_modified = r.headers.get('Last-Modified'), size = size, sha256 = digest)
+    return LocalResult(link, path, status_code = r.status_code)
+
+
+def stream_to_file(r, path):
+    # body bytes are written as received (no re-serialisation) to a temporary file beside `path`
+    tmp_path = get_store().temp_path(path)
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size = CHUNK_SIZE):
+                f.write(chunk)
+                sha.update(chunk)
+                size += len(chunk)
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        r.close()
+    return (tmp_path, size, sha.hexdigest())
+
+
+def pretty_print_json(paths):
+    # optional post-download step that re-indents saved JSON for reading; the manifest keeps the hash of
+    # the body as EDIT sent it, so incremental runs are unaffected. Only files written this run are passed in,
+    # so files that were unchanged keep their contents and modification times
+    for json_path in paths:
+        with open(json_path, 'r', encoding='utf-8') as jf:
+            d = json.load(jf)
+        write_atomic(json_path, json.dumps(d, ensure_ascii=False, indent = 4))
+
+
+def set_planner(prune = False):
+    global _prune, _endpoint_stats, _reprobe, _planned_out
+    _prune = prune
+    _reprobe = {}
+    # statistics are read once so this run's answers do not change the plan part way through
+    if _manifest is not None:
+        _endpoint_stats = _manifest.endpoint_stats()
     else:
-        if r.status_code == 404:
-            print('Page not found.')
-            return r
-    
-    if save:
-        print('Saving', path)
-        if l_ext == '.txt':
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(r.text)
-        elif l_ext == '.json':
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(r.json(), f, ensure_ascii=False, indent = 4)
-        elif l_ext == '.pdf':
-            with open(path, 'wb') as f:
-                f.write(r.content)
+        _endpoint_stats = {}
+    _planned_out = 0
+
+
+def skip_endpoint(endpoint, site_type, states = None):
+    if endpoint in SITE_TYPE_SKIP.get(site_type, []):
+        return True
+    # an ecoclass without any model states has no transitions to describe
+    if endpoint == 'transitions.json' and states is not None and not states.get('states'):
+        return True
+    requests_made, not_found = _endpoint_stats.get((endpoint, site_type), (0, 0))
+    if requests_made < PLAN_MIN_SAMPLES or not_found != requests_made:
+        return False
+    with _plan_lock:
+        n = _reprobe.get((endpoint, site_type), 0)
+        _reprobe[(endpoint, site_type)] = n + 1
+    return n % PLAN_REPROBE != 0
+
+
+def plan_jobs(jobs, states = None):
+    global _planned_out
+    planned = []
+    for j in jobs:
+        if not _write_files:
+            j['save'] = False
+        if j.get('required') or j.get('sink'):
+            planned.append(j)
+        elif not j.get('save'):
+            # nothing would be done with the response
+            continue
+        elif _prune and skip_endpoint(os.path.basename(j.get('endpoint', '')), j.get('site_type'), states):
+            continue
+        else:
+            planned.append(j)
+    with _plan_lock:
+        _planned_out += len(jobs) - len(planned)
+    return planned
+
+
+def set_metadata_cache(ttl = CACHE_TTL):
+    global _cache_ttl, _metadata
+    _cache_ttl = ttl
+    with _metadata_lock:
+        if _manifest is not None:
+            _metadata = _manifest.metadata()
+        else:
+            _metadata = {}
+
+
+def cached_metadata(url, ttl = None):
+    if ttl is None:
+        ttl = _cache_ttl
+    with _metadata_lock:
+        entry = _metadata.get(url)
+    if entry is None or time.time() - entry[0] > ttl * 3600:
+        return None
+    return json.loads(entry[1])
+
+
+def remember_metadata(url, data):
+    fetched = time.time()
+    body = json.dumps(data)
+    with _metadata_lock:
+        _metadata[url] = (fetched, body)
+    if _manifest is not None:
+        _manifest.record_metadata(url, fetched, body)
+
+
+class CachedResult:
+    # stands in for a response served from the metadata cache
+    def __init__(self, link, data):
+        self.url = link
+        self.data = data
+        self.status_code = 200
+
+    def __bool__(self):
+        return True
+
+    def json(self):
+        return self.data
+
+
+def run_job(job):
+    try:
+        if not job.get('metadata'):
+            return fetch_job(job)
+        link = job.get('link')
+        data = cached_metadata(link)
+        if data is not None and (not job.get('save') or get_store().exists(job.get('path'))):
+            if job.get('save') and _manifest is not None:
+                _manifest.finish(link, 'done')
+            get_metrics().count(endpoint_name(job.get('endpoint')), 'cached')
+            return CachedResult(link, data)
+        r = fetch_job(job)
+        if r:
+            remember_metadata(link, r.json())
+        return r
+    finally:
+        get_metrics().advance()
+
+
+def fetch_job(job):
+    link = job.get('link')
+    path = job.get('path')
+    save = job.get('save')
+    if not save or _manifest is None:
+        return send_request(link = link, path = path, save = save, endpoint = job.get('endpoint'))
+    if _resume:
+        status = _manifest.task_status(link)
+        if status == 'done' and get_store().exists(path):
+            get_metrics().count(endpoint_name(job.get('endpoint')), 'cached')
+            return LocalResult(link, path)
+        elif status == 'missing':
+            return None
+    try:
+        r = send_request(link = link, path = path, save = save, endpoint = job.get('endpoint'))
+    except Exception:
+        _manifest.finish(link, 'failed')
+        raise
+    if job.get('site_type') and (r or (r is not None and r.status_code == 404)):
+        _manifest.record_endpoint(os.path.basename(job.get('endpoint')), job.get('site_type'), found = bool(r))
+    if r:
+        _manifest.finish(link, 'done')
+    elif r is not None and r.status_code == 404:
+        _manifest.finish(link, 'missing')
+    else:
+        _manifest.finish(link, 'failed')
     return r
 
+
+def fetch_links(jobs, executor = None):
+    # jobs are dicts of link, path and save plus the geoUnit/ecoclass/community they belong to; responses
+    # are returned in job order
+    if _manifest is not None:
+        _manifest.enqueue([j for j in jobs if j.get('save')])
+    get_metrics().add_total(len(jobs))
+    if executor is None:
+        return [run_job(j) for j in jobs]
+    futures = [executor.submit(run_job, j) for j in jobs]
+    return [f.result() for f in futures]
+
            
-def get_catalog(path, catalog = 'esd', save = False):
-    geo_unit_list = None
-    base_link = 'https://edit.jornada.nmsu.edu/services/downloads/{catalog}/'
+def catalog_jobs(path, catalog = 'esd', save = False):
+    base_link = ''.join((EDIT_URL, '/services/downloads/{catalog}/'))
     links = ['geo-unit-list.json']
     add_links = ['geo-unit-list.txt',
                  'class-list.txt']
     if save:
         links.extend(add_links)
     out_dir = os.path.join(path, catalog)
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    jobs = []
     for l in links:
         link = ''.join((base_link, l)).format(catalog = catalog)
         fname = os.path.basename(link)
         out_path = os.path.join(out_dir, fname)
-        r = send_request(link = link, path = out_path, save = save)
-        if l == 'geo-unit-list.json':
+        jobs.append({'link': link, 'path': out_path, 'save': save, 'endpoint': l,
+                     'metadata': l == 'geo-unit-list.json'})
+    return jobs
+
+
+def get_catalog(path, catalog = 'esd', save = False):
+    geo_unit_list = None
+    get_store().makedirs(os.path.join(path, catalog))
+    jobs = catalog_jobs(path = path, catalog = catalog, save = save)
+    responses = fetch_links(jobs)
+    for job, r in zip(jobs, responses):
+        if job.get('endpoint') == 'geo-unit-list.json':
             if r:
                 if r.status_code != 404:
                     geo_unit_list = r.json()
     return geo_unit_list
 
 
-
-def get_geoUnit(geoUnit, path, catalog = 'esd', save = True):
-    class_list = None
-    base_text = 'https://edit.jornada.nmsu.edu/services/downloads/{catalog}/'
-    base_pdf = 'https://edit.jornada.nmsu.edu/services/descriptions/{catalog}/'
+def geoUnit_jobs(geoUnit, path, catalog = 'esd', save = True):
+    base_text = ''.join((EDIT_URL, '/services/downloads/{catalog}/'))
+    base_pdf = ''.join((EDIT_URL, '/services/descriptions/{catalog}/'))
     links = ['{geoUnit}/class-list.json']
     add_links = ['{geoUnit}/class-list.txt',
                  '{geoUnit}/climatic-features.txt',
@@ -150,7 +960,7 @@ def get_geoUnit(geoUnit, path, catalog = 'esd', save = True):
     if save:
         links.extend(add_links)
     out_dir = os.path.join(path, catalog, geoUnit)
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    jobs = []
     for l in links:
         if os.path.splitext(l)[1] == '.pdf':
             base = base_pdf
@@ -160,18 +970,27 @@ def get_geoUnit(geoUnit, path, catalog = 'esd', save = True):
         link = l_full.format(catalog = catalog, geoUnit = geoUnit)
         fname = os.path.basename(link)
         out_path = os.path.join(out_dir, fname)
-        r = send_request(link = link, path = out_path, save = save)
-        if l == '{geoUnit}/class-list.json':
+        jobs.append({'link': link, 'path': out_path, 'save': save, 'geoUnit': geoUnit, 'endpoint': l,
+                     'metadata': l == '{geoUnit}/class-list.json'})
+    return jobs
+
+
+def get_geoUnit(geoUnit, path, catalog = 'esd', save = True, executor = None):
+    class_list = None
+    get_store().makedirs(os.path.join(path, catalog, geoUnit))
+    jobs = geoUnit_jobs(geoUnit = geoUnit, path = path, catalog = catalog, save = save)
+    responses = fetch_links(jobs, executor = executor)
+    for job, r in zip(jobs, responses):
+        if job.get('endpoint') == '{geoUnit}/class-list.json':
             if r:
                 if r.status_code != 404:
                     class_list = r.json()
     return class_list
 
 
-def get_ecoclass(ecoclass, geoUnit, path, catalog = 'esd', save = True, aux = True):
-    state_list = None
-    base_desc = 'https://edit.jornada.nmsu.edu/services/descriptions/{catalog}/{geoUnit}/'
-    base_model = 'https://edit.jornada.nmsu.edu/services/models/{catalog}/{geoUnit}/'
+def ecoclass_jobs(ecoclass, geoUnit, path, catalog = 'esd', save = True, aux = True):
+    base_desc = ''.join((EDIT_URL, '/services/descriptions/{catalog}/{geoUnit}/'))
+    base_model = ''.join((EDIT_URL, '/services/models/{catalog}/{geoUnit}/'))
     links = ['{ecoclass}/states.json']
     add_links = ['{ecoclass}.json',
              '{ecoclass}/overview.json',
@@ -190,7 +1009,7 @@ def get_ecoclass(ecoclass, geoUnit, path, catalog = 'esd', save = True, aux = Tr
     if save:
         links.extend(add_links)
     out_dir = os.path.join(path, catalog, geoUnit, ecoclass)
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    jobs = []
     for l in links:
         if l in ['{ecoclass}/states.json', '{ecoclass}/transitions.json']:
             base = base_model
@@ -201,23 +1020,46 @@ def get_ecoclass(ecoclass, geoUnit, path, catalog = 'esd', save = True, aux = Tr
         fname = os.path.basename(link)
         out_path = os.path.join(out_dir, fname)
         if aux:
-            r = send_request(link = link, path = out_path, save = save)
+            save_mod = save
         else:
             if l in ['{ecoclass}.json', '{ecoclass}.pdf']:
                 save_mod = True
             else:
                 save_mod = False
-            r = send_request(link = link, path = out_path, save = save_mod)
-        if l == '{ecoclass}/states.json':
-            if r:
-                if r.status_code != 404:
-                    state_list = r.json()
+        jobs.append({'link': link, 'path': out_path, 'save': save_mod, 'geoUnit': geoUnit, 'ecoclass': ecoclass,
+                     'endpoint': l, 'site_type': ecoclass[0], 'required': l == '{ecoclass}/states.json',
+                     'metadata': l == '{ecoclass}/states.json', 'sink': _sink is not None and l == '{ecoclass}.json'})
+    return jobs
+
+
+def get_ecoclass(ecoclass, geoUnit, path, catalog = 'esd', save = True, aux = True, executor = None):
+    state_list = None
+    get_store().makedirs(os.path.join(path, catalog, geoUnit, ecoclass))
+    jobs = ecoclass_jobs(ecoclass = ecoclass, geoUnit = geoUnit, path = path, catalog = catalog, save = save,
+                         aux = aux)
+    if _prune:
+        # the model states are fetched first so they can inform which other sections are requested
+        responses = fetch_links(plan_jobs(jobs[:1]), executor = executor)
+        if responses[0]:
+            state_list = responses[0].json()
+        jobs = plan_jobs(jobs[1:], states = state_list)
+        responses = fetch_links(jobs, executor = executor)
+    else:
+        jobs = plan_jobs(jobs)
+        responses = fetch_links(jobs, executor = executor)
+        for job, r in zip(jobs, responses):
+            if job.get('endpoint') == '{ecoclass}/states.json':
+                if r:
+                    if r.status_code != 404:
+                        state_list = r.json()
+    for job, r in zip(jobs, responses):
+        if job.get('sink') and r:
+            _sink.write_ecoclass(ecoclass, r.json())
     return state_list
 
 
-def get_community(community, state, landUse, ecoclass, geoUnit, path, catalog = 'esd', save = True):
-    prod_list = None
-    base = 'https://edit.jornada.nmsu.edu/services/plant-community-tables/{catalog}/{geoUnit}/{ecoclass}/'
+def community_jobs(community, state, landUse, ecoclass, geoUnit, path, catalog = 'esd', save = True):
+    base = ''.join((EDIT_URL, '/services/plant-community-tables/{catalog}/{geoUnit}/{ecoclass}/'))
     links = ['{landUse}/{state}/{community}/annual-production.json']
     add_links = ['{landUse}/{state}/{community}/canopy-structure.json',
                  '{landUse}/{state}/{community}/forest-overstory.json',
@@ -232,49 +1074,274 @@ def get_community(community, state, landUse, ecoclass, geoUnit, path, catalog =
         links.extend(add_links)
     com_dir = '_'.join((str(landUse), str(state), str(community)))
     out_dir = os.path.join(path, catalog, geoUnit, ecoclass, com_dir)
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    jobs = []
     for l in links:
         l_full = ''.join((base, l))
         link = l_full.format(catalog = catalog, geoUnit = geoUnit, ecoclass = ecoclass, landUse = landUse,
                              state = state, community = community)
         fname = os.path.basename(link)
         out_path = os.path.join(out_dir, fname)
-        r = send_request(link = link, path = out_path, save = save)
-        if l == '{landUse}/{state}/{community}/annual-production.json':
+        jobs.append({'link': link, 'path': out_path, 'save': save, 'geoUnit': geoUnit, 'ecoclass': ecoclass,
+                     'community': com_dir, 'endpoint': l, 'site_type': ecoclass[0],
+                     'required': l == '{landUse}/{state}/{community}/annual-production.json',
+                     'sink': _sink is not None and os.path.basename(l) in COMMUNITY_TABLES})
+    return jobs
+
+
+def get_community(community, state, landUse, ecoclass, geoUnit, path, catalog = 'esd', save = True,
+                  executor = None):
+    prod_list = None
+    com_dir = '_'.join((str(landUse), str(state), str(community)))
+    get_store().makedirs(os.path.join(path, catalog, geoUnit, ecoclass, com_dir))
+    jobs = community_jobs(community = community, state = state, landUse = landUse, ecoclass = ecoclass,
+                          geoUnit = geoUnit, path = path, catalog = catalog, save = save)
+    jobs = plan_jobs(jobs)
+    responses = fetch_links(jobs, executor = executor)
+    for job, r in zip(jobs, responses):
+        if job.get('endpoint') == '{landUse}/{state}/{community}/annual-production.json':
             if r:
                 if r.status_code != 404:
                     prod_list = r.json()
-                    
+        if job.get('sink') and r:
+            tbl = COMMUNITY_TABLES.get(os.path.basename(job.get('endpoint')))
+            _sink.write_community(tbl, ecoclass, landUse, state, community, r.json())
+
     return prod_list
 
 
-def download_edit(path, geoUnits, world = False, geoworld = True, eco_all = True, eco_save = True,
-                  state_save = True):
+def state_communities(state_dict):
+    return [{'landUse': x.get('landUse'), 'state':x.get('state'), 'community': x.get('community')}
+            for x in state_dict.get('states') if x.get('community') != 'NA']
+
+
+def crawl_ecoclass(ecoclass, geoUnit, path, eco_all = True, eco_save = True, state_save = True,
+                   executor = None):
+    log.info('\t%s...', ecoclass)
+    state_dict = get_ecoclass(ecoclass=ecoclass, geoUnit=geoUnit, path=path, catalog='esd', save=eco_save,
+                              aux=eco_all, executor=executor)
+    if state_save and state_dict:
+        for sdict in state_communities(state_dict):
+            log.debug('\t\tState: %s %s', ecoclass, sdict)
+            prod_dict = get_community(community=sdict.get('community'), state=sdict.get('state'),
+                                      landUse=sdict.get('landUse'), ecoclass=ecoclass, geoUnit=geoUnit,
+                                      path=path, catalog='esd', save=state_save, executor=executor)
+
+
+def group_ecolist(ecolist):
+    by_geoUnit = {}
+    for ecoclass in dict.fromkeys(ecolist):
+        match = ECOCLASS_PAT.match(ecoclass)
+        if match:
+            by_geoUnit.setdefault(match.group(1), []).append(ecoclass)
+        else:
+            log.warning('Could not match a geoUnit in %s.', ecoclass)
+    return by_geoUnit
+
+
+def ecolist_jobs(by_geoUnit, path, catalog = 'esd'):
+    jobs = []
+    for geoUnit, ecoclasses in by_geoUnit.items():
+        jobs.extend([j for j in geoUnit_jobs(geoUnit=geoUnit, path=path, catalog=catalog, save=True)
+                     if j.get('endpoint') == '{geoUnit}/annual-production.txt'])
+        for ecoclass in ecoclasses:
+            # without the auxiliary sections only the ecoclass JSON and PDF are saved
+            jobs.extend([j for j in ecoclass_jobs(ecoclass=ecoclass, geoUnit=geoUnit, path=path, catalog=catalog,
+                                                  save=True, aux=False) if j.get('save')])
+    return jobs
+
+
+def get_from_edit(ecolist, path, catalog = 'esd', executor = None):
+    # downloads the JSON and PDF of each listed ecoclass and the annual production table of each geoUnit
+    # they belong to; ecoclasses are grouped by geoUnit so that table is requested once per geoUnit, and
+    # every file is fetched in one batch through the file pool
+    by_geoUnit = group_ecolist(ecolist)
+    for geoUnit, ecoclasses in by_geoUnit.items():
+        get_store().makedirs(os.path.join(path, catalog, geoUnit))
+        for ecoclass in ecoclasses:
+            get_store().makedirs(os.path.join(path, catalog, geoUnit, ecoclass))
+    jobs = plan_jobs(ecolist_jobs(by_geoUnit, path=path, catalog=catalog))
+    log.info('Downloading %d ecoclasses in %d geoUnits...', sum([len(x) for x in by_geoUnit.values()]),
+             len(by_geoUnit))
+    responses = fetch_links(jobs, executor=executor)
+    missing = []
+    for job, r in zip(jobs, responses):
+        if job.get('endpoint') == '{ecoclass}.json':
+            if r:
+                log.info('\t%s', job.get('ecoclass'))
+            else:
+                missing.append(job.get('ecoclass'))
+        if job.get('sink') and r:
+            _sink.write_ecoclass(job.get('ecoclass'), r.json())
+    if missing:
+        log.warning('Ecoclasses not retrieved (%d): %s', len(missing), ' '.join(missing))
+    return responses
+
+
+def crawl_catalog(path, geoUnits, world = False, geoworld = True, eco_all = True, eco_save = True,
+                  state_save = True, file_pool = None, crawl_pool = None):
     gu_dict = get_catalog(path=path, catalog='esd', save=world)
-    gu_list = [x.get('symbol') for x in gu_dict.get('geoUnits')]
+    if not gu_dict:
+        log.error('Could not retrieve the geoUnit catalog.')
+        return
+    gu_set = {x.get('symbol') for x in gu_dict.get('geoUnits')}
+    futures = []
     for g in geoUnits:
-        if g not in gu_list:
-            print("Could not find", g, "in available geoUnits.")
+        if g not in gu_set:
+            log.warning('Could not find %s in available geoUnits.', g)
         else:
-            print('Downloading ', g, '...', sep = '')
-            class_dict = get_geoUnit(geoUnit=g, path=path, catalog='esd', save=geoworld)
+            log.info('Downloading %s...', g)
+            class_dict = get_geoUnit(geoUnit=g, path=path, catalog='esd', save=geoworld, executor=file_pool)
+            if not class_dict:
+                log.error('Could not retrieve the class list for %s.', g)
+                continue
             class_list = [x.get('id') for x in class_dict.get('ecoclasses')]
             for ecoclass in class_list:
-                print('\t', ecoclass, '...', sep='')
-                state_dict = get_ecoclass(ecoclass=ecoclass, geoUnit=g, path=path, catalog='esd', save=eco_save,
-                                        aux=eco_all)
-                if state_save:
-                    state_list = [{'landUse': x.get('landUse'), 'state':x.get('state'), 
-                                   'community': x.get('community')} for x in state_dict.get('states') 
-                                  if x.get('community') != 'NA']
-                    for sdict in state_list:
-                        print('\t\tState: ', sdict, sep='')
-                        prod_dict = get_community(community=sdict.get('community'), state=sdict.get('state'), 
-                                                  landUse=sdict.get('landUse'), ecoclass=ecoclass, geoUnit=g,
-                                                  path=path, catalog='esd', save=state_save)
+                kwargs = {'ecoclass': ecoclass, 'geoUnit': g, 'path': path, 'eco_all': eco_all,
+                          'eco_save': eco_save, 'state_save': state_save, 'executor': file_pool}
+                if crawl_pool is None:
+                    crawl_ecoclass(**kwargs)
+                else:
+                    futures.append(crawl_pool.submit(crawl_ecoclass, **kwargs))
+    for f in as_completed(futures):
+        f.result()
+
 
+def download_edit(path, geoUnits, world = False, geoworld = True, eco_all = True, eco_save = True,
+                  state_save = True, concurrency = 1, host_limit = HOST_LIMIT, pool_size = None,
+                  incremental = False, resume = False, pretty = False, rate = None, max_attempts = MAX_ATTEMPTS,
+                  prune = False, db = None, files = True, store = 'files', cache_ttl = CACHE_TTL, progress = False,
+                  report = None, ecolist = None):
+    metrics = open_metrics(progress=progress)
+    set_host_limit(host_limit)
+    set_throttle(rate=rate, max_attempts=max_attempts)
+    if pool_size is None:
+        # enough pooled connections that no in-flight request has to open a throwaway one
+        pool_size = max(POOL_SIZE, host_limit)
+    set_pool_size(pool_size)
+    manifest = open_manifest(root=path, incremental=incremental, resume=resume)
+    set_planner(prune=prune)
+    set_metadata_cache(ttl=cache_ttl)
+    open_sink(db_path=db, write_files=files)
+    open_store(root=path, kind=store)
+    if pretty and store != 'files':
+        log.warning('--pretty only applies to --store files; packed JSON is kept as received.')
+    if not files:
+        world = False
+        geoworld = False
+    if concurrency > 1:
+        # ecoclasses are crawled by one pool while their individual files are fetched by another, so a
+        # crawl worker waiting on its files can never starve the pool those files run in.
+        file_pool = ThreadPoolExecutor(max_workers=concurrency)
+        crawl_pool = ThreadPoolExecutor(max_workers=concurrency)
+    else:
+        file_pool = None
+        crawl_pool = None
+    try:
+        if ecolist is not None:
+            get_from_edit(ecolist=ecolist, path=path, catalog='esd', executor=file_pool)
+        else:
+            crawl_catalog(path=path, geoUnits=geoUnits, world=world, geoworld=geoworld, eco_all=eco_all,
+                          eco_save=eco_save, state_save=state_save, file_pool=file_pool, crawl_pool=crawl_pool)
+        if pretty and store == 'files':
+            log.info('Formatting JSON...')
+            with _saved_lock:
+                saved = sorted(_saved_json)
+            pretty_print_json(saved)
+        counts = manifest.task_counts()
+        if counts:
+            log.info('File tasks: %s', ', '.join([' '.join((str(v), k)) for k, v in counts.items()]))
+        if _planned_out:
+            log.info('Requests skipped by the planner: %d', _planned_out)
+        failed = failed_urls()
+        if failed:
+            log.warning('Permanently failed URLs (%d):', len(failed))
+            for link, reason in sorted(failed.items()):
+                log.warning('\t%s\t%s', link, reason)
+    finally:
+        if crawl_pool is not None:
+            # queued work is dropped so an interrupt or a failed ecoclass ends the run once the ecoclasses
+            # in progress finish; --resume picks up the rest
+            crawl_pool.shutdown(wait=True, cancel_futures=True)
+            file_pool.shutdown(wait=True, cancel_futures=True)
+        metrics.close()
+        # written even when the run is interrupted, so a partial crawl can still be sized from it
+        run_report = metrics.report()
+        write_report(report or os.path.join(path, REPORT_NAME), run_report)
+        log_report(run_report)
+        close_metrics()
+        close_sink()
+        close_store()
+        close_manifest()
 
 
+def plan_download(path, geoUnits, world = False, geoworld = True, eco_all = True, eco_save = True,
+                  state_save = True, prune = False, ecolist = None):
+    # works out every request a download into `path` would make from the cached metadata alone, without
+    # contacting EDIT, and writes it to download_plan.tsv
+    if not geoUnits and ecolist is None:
+        log.error('No geoUnits or ecolist given to plan.')
+        return
+    if not os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+        log.error('No earlier download found in %s; run one into it first.', path)
+        return
+    open_manifest(root=path, resume=True)
+    set_planner(prune=prune)
+    set_metadata_cache()
+    forever = float('inf')
+    planned = []
+    uncached = []
+    try:
+        if ecolist is not None:
+            planned.extend(plan_jobs(ecolist_jobs(group_ecolist(ecolist), path=path)))
+        else:
+            jobs = catalog_jobs(path=path, catalog='esd', save=world)
+            planned.extend(plan_jobs(jobs))
+            gu_dict = cached_metadata(jobs[0].get('link'), ttl=forever)
+            if not gu_dict:
+                log.error('The geoUnit catalog is not cached in %s; run a download into it first.', path)
+                return
+            gu_set = {x.get('symbol') for x in gu_dict.get('geoUnits')}
+            for g in geoUnits:
+                if g not in gu_set:
+                    log.warning('Could not find %s in available geoUnits.', g)
+                    continue
+                jobs = geoUnit_jobs(geoUnit=g, path=path, catalog='esd', save=geoworld)
+                planned.extend(plan_jobs(jobs))
+                class_dict = cached_metadata(jobs[0].get('link'), ttl=forever)
+                if not class_dict:
+                    uncached.append(g)
+                    continue
+                for ecoclass in [x.get('id') for x in class_dict.get('ecoclasses')]:
+                    jobs = ecoclass_jobs(ecoclass=ecoclass, geoUnit=g, path=path, catalog='esd', save=eco_save,
+                                         aux=eco_all)
+                    state_dict = cached_metadata(jobs[0].get('link'), ttl=forever)
+                    planned.extend(plan_jobs(jobs[:1]))
+                    planned.extend(plan_jobs(jobs[1:], states=state_dict))
+                    if state_dict is None:
+                        uncached.append(ecoclass)
+                        continue
+                    if state_save:
+                        for sdict in state_communities(state_dict):
+                            planned.extend(plan_jobs(community_jobs(community=sdict.get('community'),
+                                                                    state=sdict.get('state'),
+                                                                    landUse=sdict.get('landUse'), ecoclass=ecoclass,
+                                                                    geoUnit=g, path=path, catalog='esd',
+                                                                    save=state_save)))
+        lines = ['\t'.join(('link', 'path', 'geoUnit', 'ecoclass', 'community'))]
+        lines.extend(['\t'.join((j.get('link'), os.path.relpath(j.get('path'), path), j.get('geoUnit', ''),
+                                 j.get('ecoclass', ''), j.get('community', ''))) for j in planned])
+        plan_path = os.path.join(path, 'download_plan.tsv')
+        write_atomic(plan_path, '\n'.join(lines) + '\n')
+        log.info('Planned requests: %d (%d saved)', len(planned), sum([1 for j in planned if j.get('save')]))
+        if _planned_out:
+            log.info('Requests skipped by the planner: %d', _planned_out)
+        if uncached:
+            # their class lists or model states were missing on EDIT or have never been downloaded, so the
+            # files below them cannot be planned
+            log.warning('No cached metadata for (%d): %s', len(uncached), ' '.join(uncached))
+        log.info('Plan written to %s', plan_path)
+    finally:
+        close_manifest()
 
 
 if __name__ == "__main__":
@@ -293,11 +1360,92 @@ if __name__ == "__main__":
     parser.add_argument('-g', '--geoUnits', nargs = '*', 
                         help = 'An set of MLRA/LRU codes in the format of "\d{3}[A-Z]" (e.g. "010X") whose data will be'
                                ' downloaded to `outpath`')
+    parser.add_argument('-l', '--ecolist',
+                        help = 'text file listing one ecoclass id per line; instead of crawling geoUnits, only the '
+                               'JSON and PDF of these ecoclasses and the annual production table of their geoUnits '
+                               'are downloaded')
+    parser.add_argument('-i', '--incremental', action = 'store_true',
+                        help = 'only re-download files that have changed on EDIT since they were last saved to '
+                               '`outpath`')
+    parser.add_argument('-r', '--resume', action = 'store_true',
+                        help = 'continue an interrupted download into `outpath`, skipping files it already '
+                               'completed')
+    parser.add_argument('-P', '--prune', action = 'store_true',
+                        help = 'skip ecoclass and community tables that do not exist for the site type or that '
+                               'have always been missing in earlier runs into `outpath`')
+    parser.add_argument('-p', '--pretty', action = 'store_true',
+                        help = 'indent saved JSON files once the download finishes (saved as received otherwise); '
+                               'not applied with --store pack')
+    parser.add_argument('-d', '--db',
+                        help = 'SQLite database that ecoclass general information, associated/similar sites, '
+                               'annual production and plant composition are written to as they are downloaded')
+    parser.add_argument('-n', '--no_files', action = 'store_true',
+                        help = 'with --db, only load the database and do not write the file tree to `outpath`')
+    parser.add_argument('--store', choices = ['files', 'pack'], default = 'files',
+                        help = 'save downloads as a directory tree (files) or as one compressed pack per geoUnit '
+                               '(pack; see edit_store.py to extract) (default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type = int, default = 1,
+                        help = 'number of ecoclasses (and files within them) downloaded in parallel')
+    parser.add_argument('--host_limit', type = int, default = HOST_LIMIT,
+                        help = 'maximum number of simultaneous requests to a single host (default: %(default)s)')
+    parser.add_argument('--rate', type = float,
+                        help = 'maximum average number of requests per second (default: unlimited)')
+    parser.add_argument('--max_attempts', type = int, default = MAX_ATTEMPTS,
+                        help = 'attempts per file before it is reported as failed (default: %(default)s)')
+    parser.add_argument('--pool_size', type = int,
+                        help = 'number of keep-alive connections kept open per host (default: the larger of '
+                               f'{POOL_SIZE} and --host_limit)')
+    parser.add_argument('--cache_ttl', type = float, default = CACHE_TTL,
+                        help = 'hours the geoUnit catalog, class lists and model states saved by an earlier run '
+                               'into `outpath` are reused instead of requested again; 0 always requests them '
+                               '(default: %(default)s)')
+    parser.add_argument('--base_url', default = EDIT_URL,
+                        help = 'root URL of the EDIT service (default: %(default)s)')
+    parser.add_argument('--progress', action = 'store_true',
+                        help = 'show a progress bar of files fetched (requires tqdm)')
+    parser.add_argument('--report',
+                        help = f'path of the JSON run report with per-endpoint request counts, bytes and latencies '
+                               f'(default: `outpath`/{REPORT_NAME})')
+    parser.add_argument('-v', '--verbose', action = 'store_true',
+                        help = 'log every file saved, unchanged or not found')
+    parser.add_argument('-q', '--quiet', action = 'store_true',
+                        help = 'only log warnings and errors')
+    parser.add_argument('--offline_plan', action = 'store_true',
+                        help = 'do not download anything; list the requests a download would make, worked out '
+                               'from the cached metadata only, in `outpath`/download_plan.tsv')
 
     args = parser.parse_args(argv)
 
-    download_edit(path=args.outpath, geoUnits=args.geoUnits, world=args.world, geoworld = args.geounit_world,
-                  eco_all=args.eco_all, state_save=args.states)
+    if args.verbose:
+        level = logging.DEBUG
+    elif args.quiet:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+    if args.progress and tqdm is not None:
+        handlers = [ProgressHandler()]
+    else:
+        handlers = None
+    logging.basicConfig(format = '%(message)s', handlers = handlers)
+    log.setLevel(level)
+    set_base_url(args.base_url)
+
+    if args.ecolist:
+        ecolist = get_ecolist(args.ecolist)
+    else:
+        ecolist = None
+
+    if args.offline_plan:
+        plan_download(path=args.outpath, geoUnits=args.geoUnits, world=args.world, geoworld=args.geounit_world,
+                      eco_all=args.eco_all, state_save=args.states, prune=args.prune, ecolist=ecolist)
+    else:
+        download_edit(path=args.outpath, geoUnits=args.geoUnits, world=args.world, geoworld = args.geounit_world,
+                      eco_all=args.eco_all, state_save=args.states, concurrency=args.concurrency,
+                      host_limit=args.host_limit, pool_size=args.pool_size, incremental=args.incremental,
+                      resume=args.resume, pretty=args.pretty, rate=args.rate, max_attempts=args.max_attempts,
+                      prune=args.prune, db=args.db, files=not (args.db and args.no_files),
+                      store=args.store, cache_ttl=args.cache_ttl, progress=args.progress, report=args.report,
+                      ecolist=ecolist)
 
-    print('\nScript finished.\n')
+    log.info('Script finished.')
 
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+import os
+import sys
+import zlib
+import tempfile
+import threading
+import argparse
+import sqlite3 as sqlite
+from pathlib import Path
+
+# zstandard compresses EDIT's JSON better and faster than zlib when it is installed; each blob records its
+# codec so packs written with either can be read back
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PACK_EXT = '.pack'
+# files are compressed into a pack this many bytes at a time; those larger than PACK_MAX_SIZE (already compressed
+# PDFs, in practice) are kept as loose files in the regular layout beside the packs
+CHUNK_SIZE = 1024 * 1024
+PACK_MAX_SIZE = 16 * 1024 * 1024
+
+
+def compress_file(f, codec, size):
+    if codec == 'zstd':
+        c = zstandard.ZstdCompressor(level = 6).compressobj(size = size)
+    elif codec == 'zlib':
+        c = zlib.compressobj(6)
+    else:
+        return f.read()
+    parts = [c.compress(chunk) for chunk in iter(lambda: f.read(CHUNK_SIZE), b'')]
+    parts.append(c.flush())
+    return b''.join(parts)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required to read zstd compressed packs')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+
+class FileStore:
+    # the original layout: one file per download in a directory per geoUnit, ecoclass and community
+    def __init__(self, root):
+        self.root = root
+
+    def makedirs(self, path):
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+    def temp_path(self, path):
+        return '.'.join((path, 'part'))
+
+    def put(self, path, tmp_path):
+        os.replace(tmp_path, path)
+
+    def exists(self, path):
+        return os.path.isfile(path)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+
+class NullStore:
+    # used when only a database is loaded (--db --no_files): no directories are created and nothing is kept
+    def __init__(self, root):
+        self.root = root
+
+    def makedirs(self, path):
+        pass
+
+    def temp_path(self, path):
+        return '.'.join((path, 'part'))
+
+    def put(self, path, tmp_path):
+        os.remove(tmp_path)
+
+    def exists(self, path):
+        return False
+
+    def read(self, path):
+        raise FileNotFoundError(path)
+
+    def close(self):
+        pass
+
+
+class PackStore:
+    # every file under <root>/<catalog>/<geoUnit>/ goes into one compressed SQLite pack,
+    # <root>/<catalog>/<geoUnit>.pack, keyed by its path relative to root; catalog level files go into
+    # <root>/<catalog>/catalog.pack
+    def __init__(self, root, codec = None):
+        self.root = root
+        if codec is None:
+            codec = 'zstd' if zstandard is not None else 'zlib'
+        self.codec = codec
+        self.cons = {}
+        self.lock = threading.Lock()
+        self.tmp_dir = os.path.join(root, '.tmp')
+        Path(self.tmp_dir).mkdir(parents=True, exist_ok=True)
+
+    def makedirs(self, path):
+        pass
+
+    def temp_path(self, path):
+        fd, tmp_path = tempfile.mkstemp(dir = self.tmp_dir, suffix = '.part')
+        os.close(fd)
+        return tmp_path
+
+    def locate(self, path):
+        name = os.path.relpath(path, self.root).replace(os.path.sep, '/')
+        parts = name.split('/')
+        if len(parts) > 2:
+            pack = os.path.join(self.root, parts[0], ''.join((parts[1], PACK_EXT)))
+        else:
+            pack = os.path.join(self.root, parts[0], ''.join(('catalog', PACK_EXT)))
+        return (pack, name)
+
+    def connect(self, pack):
+        # one connection per pack, shared under the store lock
+        con = self.cons.get(pack)
+        if con is None:
+            Path(os.path.dirname(pack)).mkdir(parents=True, exist_ok=True)
+            con = open_pack(pack, check_same_thread = False)
+            self.cons[pack] = con
+        return con
+
+    def put(self, path, tmp_path):
+        size = os.path.getsize(tmp_path)
+        if size > PACK_MAX_SIZE:
+            Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)
+            return
+        with open(tmp_path, 'rb') as f:
+            blob = compress_file(f, self.codec, size)
+        os.remove(tmp_path)
+        pack, name = self.locate(path)
+        with self.lock:
+            con = self.connect(pack)
+            with con:
+                con.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, julianday('now'), ?);",
+                            (name, self.codec, size, blob))
+
+    def exists(self, path):
+        if os.path.isfile(path):
+            return True
+        pack, name = self.locate(path)
+        if not os.path.isfile(pack):
+            return False
+        with self.lock:
+            row = self.connect(pack).execute('SELECT 1 FROM blobs WHERE name = ?;', (name,)).fetchone()
+        return row is not None
+
+    def read(self, path):
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        pack, name = self.locate(path)
+        with self.lock:
+            row = self.connect(pack).execute('SELECT codec, data FROM blobs WHERE name = ?;', (name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return decompress(row[1], row[0])
+
+    def close(self):
+        with self.lock:
+            for con in self.cons.values():
+                con.close()
+            self.cons = {}
+        # partial downloads left by this run or by an earlier one that was killed
+        if os.path.isdir(self.tmp_dir):
+            for f in os.listdir(self.tmp_dir):
+                if f.endswith('.part'):
+                    os.remove(os.path.join(self.tmp_dir, f))
+            try:
+                os.rmdir(self.tmp_dir)
+            except OSError:
+                pass
+
+
+def open_pack(pack, check_same_thread = True):
+    con = sqlite.connect(pack, check_same_thread = check_same_thread)
+    con.execute('PRAGMA journal_mode = WAL;')
+    con.execute('PRAGMA synchronous = NORMAL;')
+    con.execute('CREATE TABLE IF NOT EXISTS blobs (name TEXT PRIMARY KEY, codec TEXT, size INTEGER, '
+                'stored REAL, data BLOB);')
+    return con
+
+
+def find_packs(path):
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            if os.path.splitext(f)[1] == PACK_EXT:
+                yield os.path.join(root, f)
+
+
+def list_pack(pack):
+    # names, sizes and store times without reading any blob data
+    con = sqlite.connect(pack)
+    rows = con.execute('SELECT name, size, stored FROM blobs ORDER BY name;').fetchall()
+    con.close()
+    return rows
+
+
+def iter_pack(pack, names = None):
+    # yields (name, bytes) for every blob in the pack, or only those in `names`, in name order
+    con = sqlite.connect(pack)
+    if names is None:
+        for name, codec, data in con.execute('SELECT name, codec, data FROM blobs ORDER BY name;'):
+            yield (name, decompress(data, codec))
+    else:
+        for name in sorted(names):
+            row = con.execute('SELECT codec, data FROM blobs WHERE name = ?;', (name,)).fetchone()
+            if row is not None:
+                yield (name, decompress(row[1], row[0]))
+    con.close()
+
+
+def unpack(pack, outpath):
+    for name, data in iter_pack(pack):
+        out = os.path.join(outpath, *name.split('/'))
+        Path(os.path.dirname(out)).mkdir(parents=True, exist_ok=True)
+        with open(out, 'wb') as f:
+            f.write(data)
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Extract files from EDIT download packs into the regular'
+                                                 ' directory layout.')
+    parser.add_argument('packpath', help='pack file, or directory to recursively scan for pack files')
+    parser.add_argument('outpath', help='directory the files will be extracted to')
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.packpath):
+        packs = list(find_packs(args.packpath))
+    else:
+        packs = [args.packpath]
+    for pack in packs:
+        print('Extracting', pack)
+        unpack(pack, args.outpath)
+
+    print('\nScript finished.\n')